@@ -0,0 +1,256 @@
+
+class DancingLinks:
+    """
+    Exact cover model of a Sudoku grid, solved with Knuth's Algorithm X
+    on dancing links (an alternative to the move stack engine of
+    SudokuProblem).
+
+    Every candidate (cell, value) is a row of the matrix, covering 4
+    constraints: the cell is filled, and the value appears in the
+    cell's row, column and box. A solution is a set of rows covering
+    every constraint exactly once.
+
+    The links are built once, and every search leaves them exactly as
+    it found them, so a single instance can solve many puzzles.
+    """
+
+    def __init__(self, box_size = 3):
+        size = box_size*box_size
+        cells = size*size
+        self.size = size
+        self.cells = cells
+
+        # constraint columns: cell, row/value, column/value, box/value
+        columns = 4*cells
+        # node 0 is the root, nodes 1..columns are the column headers,
+        # and every candidate adds 4 nodes after them
+        nodes = 1 + columns + 4*cells*size
+        self.L = list(range(-1, nodes - 1))
+        self.R = list(range(1, nodes + 1))
+        self.U = list(range(nodes))
+        self.D = list(range(nodes))
+        # column header of every node, and candidate of every row node
+        self.C = list(range(nodes))
+        self.row_of = [0]*nodes
+        # number of rows left in every column
+        self.S = [0]*(columns + 1)
+
+        # the headers form the root's horizontal list
+        self.L[0] = columns
+        self.R[columns] = 0
+
+        # first node of every candidate row (candidate = cell*size+val-1)
+        self.first = [0]*(cells*size)
+        node = columns + 1
+        for cell in range(cells):
+            row = cell//size
+            col = cell%size
+            box = box_size*(row//box_size) + col//box_size
+            for val in range(size):
+                candidate = cell*size + val
+                headers = (
+                    1 + cell,
+                    1 + cells + row*size + val,
+                    1 + 2*cells + col*size + val,
+                    1 + 3*cells + box*size + val,
+                )
+                self.first[candidate] = node
+                for i, header in enumerate(headers):
+                    current = node + i
+                    # horizontal circular list of the 4 nodes
+                    self.L[current] = node + (i - 1)%4
+                    self.R[current] = node + (i + 1)%4
+                    # append at the bottom of the column
+                    self.C[current] = header
+                    self.row_of[current] = candidate
+                    self.U[current] = self.U[header]
+                    self.D[current] = header
+                    self.D[self.U[header]] = current
+                    self.U[header] = current
+                    self.S[header] += 1
+                node += 4
+
+        # search state
+        self.limit = None
+        self.keep = None
+        self.count = 0
+        self.solutions = []
+        self.chosen = []
+        self.stats = None
+        # budget check (see search), nodes tried and nodes left to try
+        # before the next check
+        self.check = None
+        self.nodes = 0
+        self.next_check = -1
+
+    def cover(self, column):
+        """
+        removes a column from the header list, and all of its rows from
+        the other columns they are in
+        """
+        L = self.L
+        R = self.R
+        U = self.U
+        D = self.D
+        C = self.C
+        S = self.S
+        R[L[column]] = R[column]
+        L[R[column]] = L[column]
+        i = D[column]
+        while i != column:
+            j = R[i]
+            while j != i:
+                D[U[j]] = D[j]
+                U[D[j]] = U[j]
+                S[C[j]] -= 1
+                j = R[j]
+            i = D[i]
+
+    def uncover(self, column):
+        """
+        undoes cover(column), relinking everything in reverse order
+        """
+        L = self.L
+        R = self.R
+        U = self.U
+        D = self.D
+        C = self.C
+        S = self.S
+        i = U[column]
+        while i != column:
+            j = L[i]
+            while j != i:
+                S[C[j]] += 1
+                D[U[j]] = j
+                U[D[j]] = j
+                j = L[j]
+            i = U[i]
+        R[L[column]] = column
+        L[R[column]] = column
+
+    def select(self, node):
+        """
+        takes the row of node into the solution, covering its columns
+        """
+        self.cover(self.C[node])
+        j = self.R[node]
+        while j != node:
+            self.cover(self.C[j])
+            j = self.R[j]
+
+    def deselect(self, node):
+        """
+        undoes select(node)
+        """
+        j = self.L[node]
+        while j != node:
+            self.uncover(self.C[j])
+            j = self.L[j]
+        self.uncover(self.C[node])
+
+    def search(self, givens, limit = None, keep = None, stats = None, check = None):
+        """
+        Counts the solutions of the puzzle with the given (cell, value)
+        givens, stopping at limit solutions (None counts them all).
+        The givens must not repeat values in any row/column/box.
+        - stats: optional SolveStats, updated with the nodes tried
+          (moves), guesses (bifurcations, rewinds) and search depth
+        - check: optional budget check, called with the number of nodes
+          tried so far; it returns how many more nodes may be tried
+          before calling it again, or raises to stop the search (the
+          links are restored all the same)
+        Returns the number of solutions found and the first keep of them
+        (as flattened grids; all of them if keep is None)
+        """
+        self.limit = limit
+        self.keep = keep
+        self.count = 0
+        self.solutions = []
+        self.chosen = []
+        self.stats = stats
+        self.check = check
+        self.nodes = 0
+        self.next_check = check(0) if check is not None else -1
+
+        # the givens are taken into the solution before the search
+        size = self.size
+        for cell, val in givens:
+            node = self.first[cell*size + val - 1]
+            self.select(node)
+            self.chosen.append(node)
+        try:
+            self._search(0)
+        finally:
+            # leaves the links as they were, for the next puzzle (the
+            # rows still chosen are the givens, plus the path to the
+            # current node if the budget check stopped the search)
+            for node in reversed(self.chosen):
+                self.deselect(node)
+            self.chosen = []
+        return self.count, self.solutions
+
+    def _search(self, depth):
+        """
+        Algorithm X: picks the column with the fewest rows left and
+        tries each of them in turn.
+        Returns True once the limit of solutions is reached
+        """
+        R = self.R
+        D = self.D
+        S = self.S
+        if R[0] == 0:
+            # every constraint is covered: a solution was found
+            self.count += 1
+            if self.keep is None or len(self.solutions) < self.keep:
+                grid = [0]*self.cells
+                for node in self.chosen:
+                    cell, val = divmod(self.row_of[node], self.size)
+                    grid[cell] = val + 1
+                self.solutions.append(grid)
+            return self.count == self.limit
+
+        # budget check, made before anything is covered at this depth,
+        # so the chosen rows are all there is to undo if it raises
+        if self.nodes == self.next_check:
+            self.next_check = self.nodes + self.check(self.nodes)
+        self.nodes += 1
+
+        # chooses the most constrained column
+        column = R[0]
+        best = column
+        best_size = S[column]
+        while column != 0 and best_size > 1:
+            if S[column] < best_size:
+                best = column
+                best_size = S[column]
+            column = R[column]
+        if best_size == 0:
+            return False
+
+        stats = self.stats
+        if stats is not None and best_size > 1 and depth + 1 > stats.max_depth:
+            stats.max_depth = depth + 1
+        self.cover(best)
+        done = False
+        node = D[best]
+        while node != best and not done:
+            if stats is not None:
+                stats.moves += 1
+                if best_size > 1:
+                    stats.bifurcations += 1
+            self.chosen.append(node)
+            j = R[node]
+            while j != node:
+                self.cover(self.C[j])
+                j = R[j]
+            done = self._search(depth + 1 if best_size > 1 else depth)
+            j = self.L[node]
+            while j != node:
+                self.uncover(self.C[j])
+                j = self.L[j]
+            self.chosen.pop()
+            if stats is not None and best_size > 1 and not done:
+                stats.rewinds += 1
+            node = D[node]
+        self.uncover(best)
+        return done
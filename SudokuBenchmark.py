@@ -0,0 +1,206 @@
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import time
+from time import perf_counter
+
+from SudokuProblem import (DEFAULT_RULES, ENGINES, INFERENCE_RULES, INVALID, MULTIPLE, SOLVED, UNSOLVABLE,
+                           MultipleSolutionsError, SudokuProblem, UnsolvableError, read_puzzle_lines)
+
+# bundled corpora, one puzzle per line (see corpora/*.txt for how each
+# tier was built)
+CORPORA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpora")
+TIERS = ("easy", "hard", "17clue", "pathological")
+
+# metrics compared between runs, and whether higher is better
+TRACKED_METRICS = {
+    "puzzles_per_sec": True,
+    "p50_ms": False,
+    "p99_ms": False,
+    "mean_moves": False,
+    "mean_rewinds": False,
+    "mean_bifurcations": False,
+}
+
+
+def load_corpus(tier):
+    """
+    returns the puzzle lines of a bundled tier (see TIERS), or of any
+    one-puzzle-per-line file if tier is a path
+    """
+    path = tier if os.path.isfile(tier) else os.path.join(CORPORA_DIR, tier + ".txt")
+    return [line.decode("ascii") for line in read_puzzle_lines(path)]
+
+
+def percentile(values, fraction):
+    """
+    nearest-rank percentile of a sorted list of values
+    """
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, math.ceil(fraction*len(values)) - 1))
+    return values[rank]
+
+
+def run_tier(puzzles, engine = "moves", rules = DEFAULT_RULES, repeat = 1):
+    """
+    Solves every puzzle repeat times with a single reused solver,
+    timing each solve. Returns a dictionary with the throughput,
+    latency percentiles (in milliseconds), the mean work counters per
+    puzzle and the number of puzzles per outcome. Malformed puzzles
+    count as INVALID (with no work), like in solve_one
+    """
+    problem = SudokuProblem(rules = rules)
+    latencies = []
+    moves = 0
+    rewinds = 0
+    bifurcations = 0
+    statuses = {}
+    for _ in range(repeat):
+        for puzzle in puzzles:
+            started = perf_counter()
+            try:
+                problem.reset(puzzle).solve(engine = engine)
+                status = SOLVED
+            except UnsolvableError:
+                status = UNSOLVABLE
+            except MultipleSolutionsError:
+                status = MULTIPLE
+            except (TypeError, ValueError):
+                # rejected by reset(): the solver holds no search to count
+                status = INVALID
+            latencies.append(perf_counter() - started)
+            if status != INVALID:
+                stats = problem.stats
+                moves += stats.moves
+                rewinds += stats.rewinds
+                bifurcations += stats.bifurcations
+            statuses[status] = statuses.get(status, 0) + 1
+
+    solved = len(latencies)
+    total = sum(latencies)
+    latencies.sort()
+    return {
+        "puzzles": solved,
+        "seconds": total,
+        "puzzles_per_sec": solved/total if total > 0 else 0.0,
+        "p50_ms": 1000*percentile(latencies, 0.50),
+        "p99_ms": 1000*percentile(latencies, 0.99),
+        "max_ms": 1000*latencies[-1] if latencies else 0.0,
+        "mean_moves": moves/solved if solved else 0.0,
+        "mean_rewinds": rewinds/solved if solved else 0.0,
+        "mean_bifurcations": bifurcations/solved if solved else 0.0,
+        "statuses": statuses,
+    }
+
+
+def run_benchmark(tiers = TIERS, engine = "moves", rules = DEFAULT_RULES, repeat = 1):
+    """
+    Runs run_tier over each tier (bundled names or file paths).
+    Returns a JSON-serializable dictionary with the run's settings and
+    environment under "meta" and the results of each tier under "tiers"
+    """
+    results = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "engine": engine,
+            "rules": list(rules),
+            "repeat": repeat,
+        },
+        "tiers": {},
+    }
+    for tier in tiers:
+        results["tiers"][tier] = run_tier(load_corpus(tier), engine, rules, repeat)
+    return results
+
+
+def compare(baseline, current, tolerance = 0.10):
+    """
+    Compares two run_benchmark results, tier by tier.
+    Returns a list of (tier, metric, old, new, regressed) tuples, where
+    regressed is set when the metric got worse by more than tolerance
+    (a fraction of the old value)
+    """
+    changes = []
+    for tier, result in current["tiers"].items():
+        old_result = baseline["tiers"].get(tier)
+        if old_result is None:
+            continue
+        for metric, higher_is_better in TRACKED_METRICS.items():
+            old = old_result.get(metric)
+            new = result.get(metric)
+            if old is None or new is None:
+                continue
+            if higher_is_better:
+                regressed = new < old*(1 - tolerance)
+            else:
+                regressed = new > old*(1 + tolerance)
+            changes.append((tier, metric, old, new, regressed))
+    return changes
+
+
+def print_results(results, out = sys.stdout):
+    """
+    prints a run_benchmark result as a table
+    """
+    print(f"engine={results['meta']['engine']} rules={','.join(results['meta']['rules']) or 'none'}", file = out)
+    print(f"{'tier':<14}{'puzzles':>8}{'puz/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'moves':>10}{'rewinds':>10}{'bifurc':>10}", file = out)
+    for tier, result in results["tiers"].items():
+        print(f"{tier:<14}{result['puzzles']:>8}{result['puzzles_per_sec']:>10.1f}{result['p50_ms']:>10.2f}"
+              f"{result['p99_ms']:>10.2f}{result['mean_moves']:>10.1f}{result['mean_rewinds']:>10.2f}"
+              f"{result['mean_bifurcations']:>10.2f}", file = out)
+
+
+def main(argv = None):
+    """
+    command-line entry point:
+        python -m SudokuBenchmark [tiers...] [--engine dlx] [--rules ...]
+            [--output run.json] [--compare baseline.json]
+    exits with status 1 if --compare finds a regression
+    """
+    parser = argparse.ArgumentParser(prog = "python -m SudokuBenchmark")
+    parser.add_argument("tiers", nargs = "*", default = list(TIERS), help = f"bundled tiers ({', '.join(TIERS)}) or puzzle files")
+    parser.add_argument("--engine", choices = ENGINES, default = "moves")
+    parser.add_argument("--rules", default = ",".join(DEFAULT_RULES),
+                        help = f"comma-separated inference rules, 'none' or 'all' (available: {', '.join(INFERENCE_RULES)})")
+    parser.add_argument("--repeat", type = int, default = 1, help = "times every puzzle is solved")
+    parser.add_argument("--output", help = "save the results to this JSON file")
+    parser.add_argument("--compare", help = "JSON file of a previous run to compare against")
+    parser.add_argument("--tolerance", type = float, default = 0.10, help = "relative change counted as a regression")
+    args = parser.parse_args(argv)
+
+    if args.rules == "none":
+        rules = ()
+    elif args.rules == "all":
+        rules = INFERENCE_RULES
+    else:
+        rules = tuple(rule for rule in args.rules.split(",") if rule)
+
+    results = run_benchmark(args.tiers, args.engine, rules, args.repeat)
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent = 2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = 0
+        print(f"\ncompared to {args.compare}:")
+        for tier, metric, old, new, regressed in compare(baseline, results, args.tolerance):
+            change = (new - old)/old*100 if old else 0.0
+            flag = "  REGRESSION" if regressed else ""
+            print(f"{tier:<14}{metric:<20}{old:>12.3f} -> {new:>12.3f} ({change:+.1f}%){flag}")
+            regressions += regressed
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
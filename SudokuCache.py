@@ -0,0 +1,299 @@
+import json
+import os
+from collections import OrderedDict
+from itertools import permutations, product
+
+from SudokuProblem import (INVALID, MULTIPLE, SOLVED, UNSOLVABLE, MultipleSolutionsError, SolveResult,
+                           SudokuProblem, UnsolvableError, parse_line)
+
+# most row/column orders tried when looking for a canonical form (the
+# form is only guaranteed canonical below this limit; past it, the
+# cache stays correct but equivalent puzzles may miss each other)
+MAX_ORDERINGS = 2048
+
+
+def _ranks(values):
+    """
+    replaces every value by its rank among the distinct values
+    """
+    order = {value: rank for rank, value in enumerate(sorted(set(values)))}
+    return [order[value] for value in values]
+
+
+def _line_colors(grid):
+    """
+    Colors the rows and columns of a flattened grid with invariants
+    that do not depend on digit labels nor on row/column order: clue
+    counts, refined a few times with the colors of the lines and digits
+    each clue meets. Equivalent puzzles get the same colors on the
+    lines that correspond to each other.
+    Returns the row colors and the column colors
+    """
+    clues = [(cell//9, cell%9, val) for cell, val in enumerate(grid) if val]
+    rows = [0]*9
+    cols = [0]*9
+    digits = [0]*10
+    for row, col, val in clues:
+        rows[row] += 1
+        cols[col] += 1
+        digits[val] += 1
+    for _ in range(3):
+        row_sigs = [[rows[row]] for row in range(9)]
+        col_sigs = [[cols[col]] for col in range(9)]
+        digit_sigs = [[digits[val]] for val in range(10)]
+        for row, col, val in clues:
+            row_sigs[row].append((cols[col], digits[val]))
+            col_sigs[col].append((rows[row], digits[val]))
+            digit_sigs[val].append((rows[row], cols[col]))
+        rows = _ranks([(sig[0], tuple(sorted(sig[1:]))) for sig in row_sigs])
+        cols = _ranks([(sig[0], tuple(sorted(sig[1:]))) for sig in col_sigs])
+        digits = _ranks([(sig[0], tuple(sorted(sig[1:]))) for sig in digit_sigs])
+    return rows, cols
+
+
+def _tie_orders(keys):
+    """
+    yields every order of the items (by index) sorted by key, where
+    items with equal keys may come in any order among themselves
+    """
+    items = sorted(range(len(keys)), key = lambda item: keys[item])
+    groups = []
+    for item in items:
+        if groups and keys[groups[-1][0]] == keys[item]:
+            groups[-1].append(item)
+        else:
+            groups.append([item])
+    for choice in product(*[permutations(group) for group in groups]):
+        yield [item for group in choice for item in group]
+
+
+def _line_orders(colors):
+    """
+    yields the orders of the 9 rows (or columns) allowed by Sudoku
+    symmetries (bands may swap, rows may swap inside their band) that
+    sort bands and lines by color, trying every order of tied ones
+    """
+    band_keys = [tuple(sorted(colors[3*band:3*band + 3])) for band in range(3)]
+    inside = [list(_tie_orders(colors[3*band:3*band + 3])) for band in range(3)]
+    for bands in _tie_orders(band_keys):
+        for choice in product(*[inside[band] for band in bands]):
+            yield [3*band + line for band, lines in zip(bands, choice) for line in lines]
+
+
+def canonical_form(grid):
+    """
+    Maps a flattened grid to a representative of its class under Sudoku
+    symmetries (digit relabelling, row/column swaps inside bands and
+    stacks, band/stack swaps and transposition).
+    Returns the canonical grid as an 81-character string, and the
+    transform to map things back: for every canonical cell, the cell of
+    the original grid it came from, and for every canonical digit, the
+    original digit
+    """
+    best = None
+    for transposed in (False, True):
+        if transposed:
+            source = [9*(cell%9) + cell//9 for cell in range(81)]
+        else:
+            source = list(range(81))
+        view = [grid[cell] for cell in source]
+        row_colors, col_colors = _line_colors(view)
+        row_orders = list(_limited(_line_orders(row_colors), MAX_ORDERINGS))
+        col_orders = list(_limited(_line_orders(col_colors), max(1, MAX_ORDERINGS//len(row_orders))))
+        for rows in row_orders:
+            for cols in col_orders:
+                labels = [0]*10
+                next_label = 1
+                text = []
+                for row in rows:
+                    base = 9*row
+                    for col in cols:
+                        val = view[base + col]
+                        if val and not labels[val]:
+                            labels[val] = next_label
+                            next_label += 1
+                        text.append(labels[val])
+                if best is None or text < best[0]:
+                    best = (text, [source[9*row + col] for row in rows for col in cols], labels)
+    text, cells, labels = best
+    # digits that do not appear in the grid get the leftover labels
+    next_label = max(labels) + 1
+    for val in range(1, 10):
+        if not labels[val]:
+            labels[val] = next_label
+            next_label += 1
+    digits = [0]*10
+    for val in range(1, 10):
+        digits[labels[val]] = val
+    return "".join(map(str, text)), (cells, digits)
+
+
+def _limited(items, limit):
+    """
+    yields at most limit items
+    """
+    for count, item in enumerate(items):
+        if count == limit:
+            return
+        yield item
+
+
+def map_back(canonical_solution, transform):
+    """
+    maps the 81-character solution of a canonical grid back to the
+    original grid's frame (see canonical_form), as a flattened grid
+    """
+    cells, digits = transform
+    grid = [0]*81
+    for cell, char in zip(cells, canonical_solution):
+        grid[cell] = digits[ord(char) - 48]
+    return grid
+
+
+class SolutionCache:
+    """
+    Front cache for SudokuProblem.solve(): puzzles are reduced to their
+    canonical form (see canonical_form), so a puzzle equivalent to one
+    already solved is answered by mapping the stored solution back.
+    Unsolvable, multi-solution and repeat-containing puzzles are cached
+    too. Repeats of the exact same puzzle skip the canonical form.
+
+    Both levels are LRU-bounded to capacity entries. With a path, the
+    canonical entries are loaded from it at creation and written back
+    by save().
+    """
+
+    def __init__(self, capacity = 100000, path = None, engine = "moves"):
+        self.capacity = capacity
+        self.path = path
+        self.engine = engine
+        self.problem = SudokuProblem()
+        # exact puzzle -> (status, flattened solution or error message)
+        self.exact = OrderedDict()
+        # canonical puzzle -> (status, canonical solution or error message)
+        self.canonical = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def _remember(self, table, key, value):
+        """
+        stores an entry as the most recently used one, evicting the
+        least recently used entry past capacity
+        """
+        table[key] = value
+        table.move_to_end(key)
+        if len(table) > self.capacity:
+            table.popitem(last = False)
+
+    def _key(self, puzzle):
+        """
+        returns the puzzle as an 81-character string of digits (raising
+        the same errors as SudokuProblem for malformed puzzles)
+        """
+        if isinstance(puzzle, (str, bytes, bytearray, memoryview)):
+            grid = parse_line(puzzle)
+        else:
+            self.problem.validate_input(puzzle)
+            grid = [element for row in puzzle for element in row]
+        return "".join(map(str, grid)), grid
+
+    def lookup(self, puzzle):
+        """
+        Returns a SolveResult for the puzzle, solving it only if neither
+        it nor an equivalent puzzle is cached
+        """
+        try:
+            key, grid = self._key(puzzle)
+        except (TypeError, ValueError) as error:
+            return SolveResult(0, INVALID, error = str(error))
+        return self._result(*self._entry(key, grid))
+
+    def _entry(self, key, grid):
+        """
+        returns the (status, flattened solution or error message) entry
+        of a well-formed puzzle, from either level of the cache or by
+        solving it
+        """
+        entry = self.exact.get(key)
+        if entry is not None:
+            self.exact.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        canonical, transform = canonical_form(grid)
+        entry = self.canonical.get(canonical)
+        if entry is not None:
+            self.canonical.move_to_end(canonical)
+            self.hits += 1
+        else:
+            self.misses += 1
+            entry = self._solve(canonical)
+            self._remember(self.canonical, canonical, entry)
+
+        status, payload = entry
+        if status == SOLVED:
+            payload = map_back(payload, transform)
+        self._remember(self.exact, key, (status, payload))
+        return status, payload
+
+    def _solve(self, canonical):
+        """
+        solves a canonical puzzle, returning its cache entry
+        """
+        try:
+            solution = self.problem.reset(canonical).solve(engine = self.engine)
+        except UnsolvableError as error:
+            return UNSOLVABLE, str(error)
+        except MultipleSolutionsError as error:
+            return MULTIPLE, str(error)
+        except ValueError as error:
+            return INVALID, str(error)
+        return SOLVED, "".join(str(element) for row in solution for element in row)
+
+    def _result(self, status, payload):
+        """
+        builds a SolveResult from a cache entry
+        """
+        if status == SOLVED:
+            return SolveResult(0, SOLVED, solution = [payload[9*i:9*i + 9] for i in range(9)])
+        return SolveResult(0, status, error = payload)
+
+    def solve(self, puzzle):
+        """
+        same as SudokuProblem(puzzle).solve(), going through the cache
+        """
+        status, payload = self._entry(*self._key(puzzle))
+        if status == SOLVED:
+            return [payload[9*i:9*i + 9] for i in range(9)]
+        if status == UNSOLVABLE:
+            raise UnsolvableError(payload)
+        if status == MULTIPLE:
+            raise MultipleSolutionsError(payload)
+        raise ValueError(payload)
+
+    def save(self, path = None):
+        """
+        writes the canonical entries to path (defaults to the cache's
+        path), replacing the file atomically.
+        Raises ValueError if neither path is set
+        """
+        path = path or self.path
+        if path is None:
+            raise ValueError("No path to save the cache to: pass one to save() or to the cache")
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as file:
+            json.dump([[key, status, payload] for key, (status, payload) in self.canonical.items()], file)
+        os.replace(temp_path, path)
+
+    def load(self, path):
+        """
+        adds the canonical entries saved in path to the cache
+        """
+        with open(path) as file:
+            for key, status, payload in json.load(file):
+                self._remember(self.canonical, key, (status, payload))
+
+    def __len__(self):
+        return len(self.canonical)
@@ -0,0 +1,287 @@
+import argparse
+import os
+import random
+import sys
+from multiprocessing import Pool
+from time import perf_counter
+
+from SudokuProblem import CELL_SHIFT, DEFAULT_RULES, REM, SET, SudokuProblem, encode_move, format_line, geometry
+
+# clue patterns: cells are removed together with their images under the
+# symmetry (180 degree rotation, left/right mirror, main diagonal, or all
+# rotations and reflections of the square)
+SYMMETRIES = ("none", "rotational", "mirror", "diagonal", "dihedral")
+# easy: solved by naked and hidden singles alone, medium: solved once the
+# default inference rules join in, hard: needs bifurcations
+DIFFICULTIES = ("easy", "medium", "hard")
+
+
+def _images(row, col, size, symmetry):
+    """
+    returns the (row, col) images of a cell under a symmetry
+    """
+    last = size - 1
+    if symmetry == "rotational":
+        return [(row, col), (last - row, last - col)]
+    if symmetry == "mirror":
+        return [(row, col), (row, last - col)]
+    if symmetry == "diagonal":
+        return [(row, col), (col, row)]
+    if symmetry == "dihedral":
+        return [(row, col), (col, last - row), (last - row, last - col), (last - col, row),
+                (row, last - col), (last - row, col), (col, row), (last - col, last - row)]
+    return [(row, col)]
+
+
+def clue_groups(symmetry = "none", box_size = 3):
+    """
+    splits the cells of the grid into the groups of cells a symmetry
+    keeps or removes together (one group per cell for "none")
+    """
+    if symmetry not in SYMMETRIES:
+        raise ValueError(f"Unknown symmetry: {symmetry}")
+    size = box_size*box_size
+    groups = []
+    seen = set()
+    for cell in range(size*size):
+        if cell in seen:
+            continue
+        group = sorted({size*row + col for row, col in _images(cell//size, cell%size, size, symmetry)})
+        seen.update(group)
+        groups.append(group)
+    return groups
+
+
+class PuzzleGenerator:
+    """
+    Generates puzzles with a unique solution: a random full grid is
+    built by the solver itself (bifurcating on random values), then
+    clues are removed (in symmetric groups, in random order) as long as
+    the solution stays unique, down to a target clue count or as far as
+    a target difficulty allows.
+
+    Removals are checked on a single solver that is never reset: the
+    clues are stacked as moves (see SudokuProblem.assume), so taking a
+    clue out only undoes the moves stacked since it, and the rest of the
+    propagation from the givens is kept. A clue can go if no solution
+    has another value in its cell, which is a search with a limit of 1
+    on top of the propagated state.
+    """
+
+    def __init__(self, box_size = 3, seed = None):
+        self.box_size = box_size
+        self.geometry = geometry(box_size)
+        self.rng = random.Random(seed)
+        # rules of the uniqueness searches: singles are fastest on 9x9
+        # grids, but larger ones bifurcate much less with locked
+        # candidates
+        self.rules = () if box_size <= 3 else ("locked_candidates",)
+        # one solver per set of inference rules, built on first use
+        self.problems = {}
+
+    def _problem(self, rules):
+        """
+        returns the generator's solver running the given rules
+        """
+        problem = self.problems.get(rules)
+        if problem is None:
+            problem = SudokuProblem(rules = rules, box_size = self.box_size)
+            self.problems[rules] = problem
+        return problem
+
+    def full_grid(self):
+        """
+        returns a random complete grid, as a flattened grid
+        """
+        problem = self._problem(())
+        problem.reset(None)
+        problem.rng = self.rng
+        try:
+            problem.search(1, 0)
+        finally:
+            problem.rng = None
+        return problem.grid.copy()
+
+    def rate(self, puzzle):
+        """
+        returns the difficulty (see DIFFICULTIES) of a puzzle with a
+        unique solution
+        """
+        for difficulty, rules in (("easy", ()), ("medium", DEFAULT_RULES)):
+            problem = self._problem(rules).reset(puzzle)
+            if problem.propagate() and problem.assigned == problem.cell_count:
+                return difficulty
+        return "hard"
+
+    def _removable(self, problem, cells, solution, solved_by_logic):
+        """
+        Checks whether the clues of a group (already taken back) can be
+        left out: with solved_by_logic, the other clues must still be
+        solved without bifurcating, otherwise the solution must stay
+        unique
+        """
+        if solved_by_logic:
+            return problem.assigned == problem.cell_count
+        for cell in cells:
+            if problem.grid[cell]:
+                # deduced from the other clues
+                continue
+            position = problem.assume([encode_move(REM, cell, solution[cell])])
+            if position is None:
+                # no other value fits the cell
+                continue
+            found = problem.search(1, 0)[0]
+            problem.undo_to(position)
+            if found:
+                return False
+        return True
+
+    def remove_clues(self, solution, clues = None, rules = None, solved_by_logic = False, symmetry = "none"):
+        """
+        Removes clues from a complete flattened grid, one group (see
+        clue_groups) at a time in random order, keeping the solution
+        unique. Stops trying to remove groups that would leave fewer
+        than clues clues (None removes as many as possible). With
+        solved_by_logic, the puzzle also stays solvable with the rules
+        (defaults to the generator's) without bifurcating.
+        Returns the puzzle as a flattened grid
+        """
+        problem = self._problem(self.rules if rules is None else rules)
+        problem.reset(None)
+        groups = clue_groups(symmetry, self.box_size)
+        self.rng.shuffle(groups)
+
+        # the groups still to try are stacked one by one (the next one
+        # on top), and the clues that stay in one go above them: every
+        # try takes back its group along with the clues kept so far,
+        # which are then stacked again
+        positions = []
+        for cells in reversed(groups):
+            positions.append(problem.assume([encode_move(SET, cell, solution[cell]) for cell in cells]))
+        kept = []
+        count = len(solution)
+        for cells in groups:
+            position = positions.pop()
+            moves = [encode_move(SET, cell, solution[cell]) for cell in cells]
+            if clues is None or count - len(cells) >= clues:
+                problem.undo_to(position)
+                problem.assume(kept)
+                if self._removable(problem, cells, solution, solved_by_logic):
+                    count -= len(cells)
+                    continue
+                problem.assume(moves)
+            kept.extend(moves)
+
+        puzzle = [0]*len(solution)
+        for move in kept:
+            puzzle[move >> CELL_SHIFT] = solution[move >> CELL_SHIFT]
+        return puzzle
+
+    def generate(self, clues = None, difficulty = None, symmetry = "none", attempts = 100, with_solution = False):
+        """
+        Generates a puzzle with a unique solution, as a line (see
+        format_line).
+        - clues: fewest clues to leave (None removes as many as possible)
+        - difficulty: the puzzle's difficulty (see DIFFICULTIES; None
+          for any). Easy and medium puzzles keep the clues their rules
+          need; medium and hard ones are retried on new grids, up to
+          attempts times, until the puzzle is not any easier
+        - symmetry: clue pattern (see SYMMETRIES)
+        With with_solution, returns a (puzzle, solution) tuple of lines.
+        Raises RuntimeError if no puzzle of the difficulty was found
+        """
+        if difficulty is not None and difficulty not in DIFFICULTIES:
+            raise ValueError(f"Unknown difficulty: {difficulty}")
+        rules = {"easy": (), "medium": DEFAULT_RULES}.get(difficulty)
+        solved_by_logic = difficulty in ("easy", "medium")
+        for _ in range(attempts):
+            solution = self.full_grid()
+            puzzle = format_line(self.remove_clues(solution, clues, rules, solved_by_logic, symmetry))
+            if difficulty in (None, "easy") or self.rate(puzzle) == difficulty:
+                if with_solution:
+                    return puzzle, format_line(solution)
+                return puzzle
+        raise RuntimeError(f"No {difficulty} puzzle found in {attempts} attempts")
+
+
+# generator reused by every task of a worker process
+_worker_generator = None
+
+
+def _generate_task(task):
+    """
+    worker entry point: generates one puzzle of generate_many
+    """
+    global _worker_generator
+    seed, clues, difficulty, symmetry, box_size = task
+    if _worker_generator is None or _worker_generator.box_size != box_size:
+        _worker_generator = PuzzleGenerator(box_size)
+    _worker_generator.rng.seed(seed)
+    return _worker_generator.generate(clues, difficulty, symmetry)
+
+
+def generate_many(count, workers = None, chunksize = 4, seed = None, clues = None, difficulty = None, symmetry = "none",
+                  box_size = 3):
+    """
+    Generates count puzzles (see PuzzleGenerator.generate) on a pool of
+    worker processes, yielding them as lines in order.
+    - workers: number of worker processes (defaults to the number of
+      cores; 1 generates everything in the calling process)
+    - chunksize: puzzles sent to a worker at a time
+    - seed: every puzzle gets its own seed derived from it, so a seeded
+      run gives the same puzzles whatever the number of workers
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    tasks = ((None if seed is None else f"{seed}:{index}", clues, difficulty, symmetry, box_size) for index in range(count))
+    if workers <= 1:
+        yield from map(_generate_task, tasks)
+        return
+    with Pool(workers) as pool:
+        yield from pool.imap(_generate_task, tasks, chunksize)
+
+
+def rate(puzzle, box_size = 3):
+    """
+    returns the difficulty (see DIFFICULTIES) of a puzzle with a unique
+    solution
+    """
+    return PuzzleGenerator(box_size).rate(puzzle)
+
+
+def main(argv = None):
+    """
+    command-line entry point:
+        python -m SudokuGenerator [COUNT] [--clues N] [--difficulty hard]
+            [--symmetry rotational] [--workers N] [--seed S] [--box-size N]
+            [--output puzzles.txt]
+    writes one puzzle per line
+    """
+    parser = argparse.ArgumentParser(prog = "python -m SudokuGenerator")
+    parser.add_argument("count", type = int, nargs = "?", default = 1, help = "number of puzzles")
+    parser.add_argument("--clues", type = int, default = None, help = "fewest clues to leave (default: as few as possible)")
+    parser.add_argument("--difficulty", choices = DIFFICULTIES, default = None)
+    parser.add_argument("--symmetry", choices = SYMMETRIES, default = "none", help = "clue pattern")
+    parser.add_argument("--workers", type = int, default = None, help = "worker processes (default: one per core)")
+    parser.add_argument("--chunksize", type = int, default = 4, help = "puzzles per worker task")
+    parser.add_argument("--seed", default = None, help = "seed, for reproducible puzzles")
+    parser.add_argument("--box-size", type = int, default = 3, help = "box size of the puzzles (3 for 9x9, 4 for 16x16...)")
+    parser.add_argument("--output", default = "-", help = "output file, '-' for stdout")
+    args = parser.parse_args(argv)
+
+    started = perf_counter()
+    out = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        for puzzle in generate_many(args.count, args.workers, args.chunksize, args.seed, args.clues, args.difficulty,
+                                    args.symmetry, args.box_size):
+            out.write(puzzle + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = perf_counter() - started
+    print(f"{args.count} puzzles in {elapsed:.2f}s ({args.count/elapsed:.1f} puzzles/s)", file = sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
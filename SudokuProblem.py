@@ -1,469 +1,2265 @@
+import argparse
+import copy
+import mmap
+import os
+import queue
+import sys
+from array import array
+from collections import OrderedDict, deque
+from functools import partial
+from itertools import combinations
+from multiprocessing import Pool
+from time import perf_counter
+
+from ExactCover import DancingLinks
+
+# moves in the move stack are packed into 16-bit integers:
+#   cell << 6 | value << 1 | op
+# where cell = size*row+col and op is SET or REM (up to 25x25 grids,
+# the largest cell index still fits in 16 bits)
+SET = 0
+REM = 1
+CELL_SHIFT = 6
+VALUE_MASK = 0x1F
+
+# largest box size supported (25x25 grids)
+MAX_BOX_SIZE = 5
+
+# number of set bits of a mask
+popcount = int.bit_count
+
+
+def _locking_part(mask, parts):
+    """
+    returns the index of the part (one of the bit groups of a Geometry)
+    holding all the bits of a mask with at least 2 bits, or -1
+    """
+    if popcount(mask) >= 2:
+        for i, part in enumerate(parts):
+            if not mask & ~part:
+                return i
+    return -1
+
+
+def _locking_table(parts, bits):
+    """
+    maps every mask of the given width to its _locking_part
+    """
+    return [_locking_part(mask, parts) for mask in range(1 << bits)]
+
+
+class _LockingCheck:
+    """
+    stands in for a _locking_table when masks are too wide to tabulate
+    (table[mask] is worked out on every lookup, from at most 5 parts)
+    """
+
+    def __init__(self, parts):
+        self.parts = parts
+
+    def __getitem__(self, mask):
+        return _locking_part(mask, self.parts)
+
+
+class Geometry:
+    """
+    Lookup tables of a grid of box_size x box_size boxes (size =
+    box_size**2 rows, columns, boxes and values). Built once per box
+    size by geometry(), and shared by every solver of that size
+    """
+
+    def __init__(self, box_size):
+        n = box_size
+        size = n*n
+        cells = size*size
+        self.box_size = n
+        self.size = size
+        self.cells = cells
+
+        # candidate masks: bit (v-1) is set if value v is still
+        # possible. a mask with a single bit set maps back to its value
+        # via bit_length()
+        self.all_values = (1 << size) - 1
+
+        # starting contents of the solver's buffers (see SudokuProblem.reset)
+        self.empty_grid = [0]*cells
+        self.full_cands = [self.all_values]*cells
+        self.full_unit = [self.all_values]*(size + 1)
+
+        # cell index lookup tables
+        self.row_of = [cell//size for cell in range(cells)]
+        self.col_of = [cell%size for cell in range(cells)]
+        self.box_of = [n*(cell//(n*size)) + (cell%size)//n for cell in range(cells)]
+        # position of a cell inside its box (n*(r%n)+(c%n))
+        self.box_pos = [n*((cell//size)%n) + cell%n for cell in range(cells)]
+        # cells of every row/column/box, indexed by the unit masks' bits
+        self.row_cells = [[size*r + c for c in range(size)] for r in range(size)]
+        self.col_cells = [[size*r + c for r in range(size)] for c in range(size)]
+        self.box_cells = [[size*(n*(b//n) + p//n) + n*(b%n) + p%n for p in range(size)] for b in range(size)]
+        self.units = self.row_cells + self.col_cells + self.box_cells
+        # unit mask bits of a row/column inside a box (box positions
+        # n*i+j), and of a box inside a row/column
+        line = (1 << n) - 1
+        self.box_row_bits = [line << n*i for i in range(n)]
+        self.box_col_bits = [sum(1 << (n*i + j) for i in range(n)) for j in range(n)]
+        self.line_box_bits = [line << n*k for k in range(n)]
+
+        # for a unit mask, the box row/box column/line box locking it
+        # (or -1)
+        if size <= 9:
+            self.locked_box_row = _locking_table(self.box_row_bits, size)
+            self.locked_box_col = _locking_table(self.box_col_bits, size)
+            self.locked_line_box = _locking_table(self.line_box_bits, size)
+        else:
+            self.locked_box_row = _LockingCheck(self.box_row_bits)
+            self.locked_box_col = _LockingCheck(self.box_col_bits)
+            self.locked_line_box = _LockingCheck(self.line_box_bits)
+
+    def rows_of(self, grid):
+        """
+        splits a flattened grid into a list of rows
+        """
+        size = self.size
+        return [grid[size*i:size*i + size] for i in range(size)]
+
+
+_GEOMETRIES = {}
+
+
+def geometry(box_size = 3):
+    """
+    returns the (shared) Geometry of a box size, building it on first use
+    """
+    if box_size not in _GEOMETRIES:
+        if not isinstance(box_size, int) or not 2 <= box_size <= MAX_BOX_SIZE:
+            raise ValueError(f"Box size must be an integer from 2 to {MAX_BOX_SIZE}")
+        _GEOMETRIES[box_size] = Geometry(box_size)
+    return _GEOMETRIES[box_size]
+
+
+# extra inference rules, from cheapest to most expensive. Each name
+# maps to a SudokuProblem.find_<name> method
+INFERENCE_RULES = (
+    "locked_candidates",
+    "naked_pairs",
+    "hidden_pairs",
+    "naked_triples",
+    "hidden_triples",
+    "x_wing",
+    "swordfish",
+)
+# rules on by default: the ones that pay for themselves in solving time
+DEFAULT_RULES = INFERENCE_RULES[:3]
+
+# search engines: the move stack of SudokuProblem, or the exact cover
+# model of ExactCover.DancingLinks
+ENGINES = ("moves", "dlx")
+
+# moves run between two checks of the timeout/cancellation budget of a
+# search (max_steps is always checked exactly)
+BUDGET_CHECK_INTERVAL = 256
+
+
+def lowest_bit(mask):
+    """
+    returns the position (starting from 0) of the lowest set bit of a
+    non-zero mask
+    """
+    return (mask & -mask).bit_length() - 1
+
+
+def bits_of(mask):
+    """
+    returns the set bits of a mask, one mask per bit, lowest first
+    """
+    bits = []
+    while mask:
+        low = mask & -mask
+        mask ^= low
+        bits.append(low)
+    return bits
+
+
+def box_of(row, col, box_size = 3):
+    """
+    returns the box index (left to right, top to bottom) of a cell
+    """
+    return box_size*(row//box_size) + (col//box_size)
+
+
+# line format: size*size characters, '0' or '.' for blanks, values past
+# 9 as letters (A for 10, B for 11...)
+VALUE_CHARS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+def _char_values():
+    """
+    returns the value of every byte of a puzzle line (past any grid
+    size for invalid characters)
+    """
+    table = [99]*256
+    for value, char in enumerate(VALUE_CHARS):
+        table[ord(char)] = value
+        table[ord(char.lower())] = value
+    table[ord(".")] = 0
+    return table
+
+
+CHAR_VALUES = _char_values()
+
+
+def parse_line(line, box_size = 3):
+    """
+    converts a puzzle line (str or bytes, one character per cell, '0'
+    or '.' for blanks, see VALUE_CHARS) into a flattened grid of
+    integers.
+    Returns an error if the line is not a valid sudoku grid
+    """
+    size = box_size*box_size
+    if isinstance(line, str):
+        line = line.encode("ascii", "replace")
+    line = bytes(line).strip()
+    if len(line) != size*size:
+        raise TypeError(f"Sudoku line must have {size*size} characters")
+    values = [CHAR_VALUES[char] for char in line]
+    if max(values) > size:
+        raise ValueError(f"Sudoku cells must contain numbers from 0 (unassigned) to {size}")
+    return values
+
+
+def format_line(grid):
+    """
+    converts a flattened grid into a puzzle line (see parse_line)
+    """
+    return "".join([VALUE_CHARS[element] for element in grid])
+
+
+def encode_move(op, cell, val):
+    """
+    packs a move (SET or REM, cell index, value) into an integer
+    """
+    return (cell << CELL_SHIFT) | (val << 1) | op
+
+
+def decode_move(move):
+    """
+    unpacks an integer move into an (op, cell, value) tuple
+    """
+    return (move & 1, move >> CELL_SHIFT, (move >> 1) & VALUE_MASK)
+
+
+class UnsolvableError(ValueError):
+    """
+    Raised when the puzzle has no solution
+    """
+
+
+class MultipleSolutionsError(ValueError):
+    """
+    Raised when the puzzle has more than one solution
+    """
+
+
+class BudgetExceededError(RuntimeError):
+    """
+    Raised when a search runs out of its budget before finishing:
+    - reason: "timeout", "max_steps" or "cancelled"
+    - stats: SolveStats of the work done so far
+    """
+
+    def __init__(self, reason, stats):
+        super().__init__(f"Search budget exceeded ({reason})")
+        self.reason = reason
+        self.stats = stats
+
+
+class SolveStats:
+    """
+    Work counters of a solve() call:
+    - moves: moves taken off the move stack (including repeated ones)
+    - sets/rems: 'set'/'rem' moves that actually changed the grid
+    - rewinds, bifurcations: number of backtracks and of guesses
+    - max_depth: deepest bifurcation stack reached
+    - backjumps: bifurcation levels skipped by conflict learning
+    - nogoods: nogoods learned, nogood_prunes: moves (or conflicts)
+      they produced (see SudokuProblem's learning)
+    - time_*: seconds spent in each phase (rewinds are not counted
+      as propagation time)
+    """
+
+    def __init__(self):
+        self.moves = 0
+        self.sets = 0
+        self.rems = 0
+        self.rewinds = 0
+        self.bifurcations = 0
+        self.max_depth = 0
+        self.backjumps = 0
+        self.nogoods = 0
+        self.nogood_prunes = 0
+        self.time_propagation = 0.0
+        self.time_inference = 0.0
+        self.time_bifurcation = 0.0
+        self.time_rewind = 0.0
+        self.time_total = 0.0
+        # per inference rule: times it found something, and candidates
+        # it removed
+        self.rule_hits = {}
+        self.rule_rems = {}
+
+    def as_dict(self):
+        """
+        returns the counters as a plain dictionary
+        """
+        return dict(vars(self))
+
+    def __repr__(self):
+        return "SolveStats(" + ", ".join(f"{k}={v!r}" for k, v in vars(self).items()) + ")"
+
+
+class Tracer:
+    """
+    Receives the solver's events, row/column based. Every method does
+    nothing by default, so subclasses only override the events they
+    care about. The solver skips event dispatch entirely when no tracer
+    is attached.
+    """
+
+    def on_set(self, row, col, val):
+        """a cell was set to a value"""
+
+    def on_rem(self, row, col, val):
+        """a value was removed from a cell's possibilities"""
+
+    def on_single(self, row, col, val, unit):
+        """a single was found; unit is 'cell', 'row', 'column' or 'box'"""
+
+    def on_clash(self, row, col, val, current):
+        """a cell already set to current could not be set to val"""
+
+    def on_conflict(self, unit, row, col, val):
+        """
+        a removal left no options: unit is 'cell' (row,col has no
+        values left) or 'row'/'column'/'box' (the unit of row,col has
+        no place for val)
+        """
+
+    def on_undo(self, op, row, col, val):
+        """a SET or REM move is being undone"""
+
+    def on_rewind(self, depth):
+        """backtracking from the bifurcation at the given depth"""
+
+    def on_rule(self, rule, count):
+        """an inference rule stacked count 'rem' moves"""
+
+    def on_bifurcate(self, row, col, val, depth):
+        """out of logical steps: guessing val for row,col"""
+
+    def on_solution(self, grid):
+        """a complete grid (list of rows) was found"""
+
+
+class ConsoleTracer(Tracer):
+    """
+    Prints every step taken by the solver (the verbose mode)
+    """
+
+    def __init__(self, box_size = 3):
+        self.box_size = box_size
+
+    def on_set(self, row, col, val):
+        print(f"Setting {row},{col} to {val}.")
+
+    def on_rem(self, row, col, val):
+        print(f"Removing {val} from possibilities for {row},{col}.")
+
+    def on_single(self, row, col, val, unit):
+        if unit == "cell":
+            print(f"Naked single found! Cell {row},{col} can only be {val}")
+        else:
+            print(f"Hidden single found! Cell {row},{col} only cell in {unit} for {val}")
+
+    def on_clash(self, row, col, val, current):
+        print(f"Set ERROR: {row},{col} is already set to {current}! Can't set it to {val}!")
+
+    def on_conflict(self, unit, row, col, val):
+        if unit == "cell":
+            print(f"Rem ERROR: cell {row},{col} is out of options!")
+        elif unit == "row":
+            print(f"Rem ERROR: row {row} has no place for {val}!")
+        elif unit == "column":
+            print(f"Rem ERROR: column {col} has no place for {val}!")
+        else:
+            print(f"Rem ERROR: box {box_of(row, col, self.box_size)} has no place for {val}!")
+
+    def on_undo(self, op, row, col, val):
+        print(f"Undoing type {'rem' if op == REM else 'set'}, cell {row},{col}, value {val}")
+
+    def on_rewind(self, depth):
+        print("<<< REWIND STARTING")
+
+    def on_rule(self, rule, count):
+        print(f"Rule {rule} found {count} candidates to remove.")
+
+    def on_bifurcate(self, row, col, val, depth):
+        print("Out of logical steps. Attempting bifurcation.")
+
+    def on_solution(self, grid):
+        print("SOLUTION FOUND!")
+        for row in grid:
+            print(row)
+        print("--------")
+
 
 class SudokuProblem:
     """
     Class contains Sudoku problem, and the solver for said problem
     """
 
-    def __init__(self, puzzle, verbose = True):
-        # puzzle: initial grid state
-        self.puzzle = puzzle.copy()
-        
+    def __init__(self, puzzle = None, verbose = False, debug = False, tracer = None, rules = DEFAULT_RULES, box_size = 3,
+                 learning = False, max_nogoods = 1024, max_nogood_size = 6):
+        # grid geometry: box_size x box_size boxes, so size = box_size**2
+        # rows, columns, boxes and values (3 for the classic 9x9 grid).
+        # its lookup tables (see Geometry) are shared by every solver
+        # of the same size, and copied here for fast access
+        geo = geometry(box_size)
+        self.box_size = box_size
+        self.size = geo.size
+        self.cell_count = geo.cells
+        self.all_values = geo.all_values
+        self.empty_grid = geo.empty_grid
+        self.full_cands = geo.full_cands
+        self.full_unit = geo.full_unit
+        self.row_of = geo.row_of
+        self.col_of = geo.col_of
+        self.box_of = geo.box_of
+        self.box_pos = geo.box_pos
+        self.row_cells = geo.row_cells
+        self.col_cells = geo.col_cells
+        self.box_cells = geo.box_cells
+        self.units = geo.units
+        self.box_row_bits = geo.box_row_bits
+        self.box_col_bits = geo.box_col_bits
+        self.line_box_bits = geo.line_box_bits
+        self.locked_box_row = geo.locked_box_row
+        self.locked_box_col = geo.locked_box_col
+        self.locked_line_box = geo.locked_line_box
+        self.rows_of = geo.rows_of
+
+        # the buffers below are allocated once, and refilled by reset()
+        # for every new puzzle
+
+        # grid: current grid state, flattened (cell size*r+c)
+        self.grid = self.empty_grid.copy()
+
         # number of assigned grid elements
         self.assigned = 0
-        
-        # possibility arrays to easily spot naked and hidden singles
-        self.possibilities = [[[True for _ in range(10)] for _ in range(9)] for _ in range(9)]
-        self.rows = [[9 for _ in range(10)] for _ in range(9)]
-        self.cols = [[9 for _ in range(10)] for _ in range(9)]
-        self.boxes = [[9 for _ in range(10)] for _ in range(9)]
-        
-        # instruction set, keeping track of bifurcations, etc
-        self.instructions = []
+
+        # candidate masks to easily spot naked and hidden singles:
+        # - cands[size*r+c] holds the values still possible for cell r,c
+        # - rows[r][v] holds the columns of row r where v can still go
+        # - cols[c][v] holds the rows of column c where v can still go
+        # - boxes[b][v] holds the positions (see Geometry.box_pos) of box b
+        #   where v can still go
+        # (index 0 of the unit tables is unused)
+        self.cands = self.full_cands.copy()
+        self.rows = [self.full_unit.copy() for _ in range(self.size)]
+        self.cols = [self.full_unit.copy() for _ in range(self.size)]
+        self.boxes = [self.full_unit.copy() for _ in range(self.size)]
+
+        # move stack (packed moves, see encode_move): moves before
+        # self.index have been executed, the ones after it are pending.
+        # bifurcations holds the positions of the bifurcation moves
+        self.trail = array('H')
         self.index = 0
-        self.bifurcations = []
-        
+        self.bifurcations = array('I')
+
         # set verbose if you want to accompany the logical steps taken
+        # on the console, or pass a Tracer to receive them as events
         self.verbose = verbose
-        
+        if tracer is None and verbose:
+            tracer = ConsoleTracer(box_size)
+        self.tracer = tracer
+
+        # work counters, see SolveStats
+        self.stats = SolveStats()
+
+        # set debug to cross-check the incremental singles detection
+        # against a full-grid sweep every time the move stack runs out
+        self.debug = debug
+
+        # inference rules tried before bifurcating (see INFERENCE_RULES
+        # for the ones available); pass an empty tuple to go straight
+        # to bifurcations
+        self.rules = []
+        for name in rules:
+            if name not in INFERENCE_RULES:
+                raise ValueError(f"Unknown inference rule: {name}")
+            self.rules.append((name, getattr(self, "find_" + name)))
+
+        # exact cover model for the "dlx" engine, built on first use
+        self.dlx = None
+
+        # optional random.Random: bifurcations then try the values of
+        # their cell in random order (used to generate random grids)
+        self.rng = None
+
+        # set learning to analyze every contradiction: moves carry the
+        # bifurcation levels they depend on (as bit masks, bit d for
+        # depth d), so rewinds can jump back past the bifurcations that
+        # had nothing to do with it, and the guesses behind it are
+        # recorded as a nogood (assignments that cannot all hold; at
+        # most max_nogoods of them, of up to max_nogood_size guesses,
+        # least recently used evicted first) that prunes later branches.
+        # the moves stacked by inference rules conservatively depend on
+        # every bifurcation, so learning works best with few rules
+        self.learning = learning
+        self.max_nogoods = max_nogoods
+        self.max_nogood_size = max_nogood_size
+        # levels of every move of the move stack, of the move that
+        # removed every (cell, value) and of the move that set every cell
+        self.reasons = []
+        self.rem_reasons = [0]*(self.cell_count*self.size)
+        self.set_reasons = [0]*self.cell_count
+        # levels behind the last contradiction (None after a solution),
+        # and the deepest level holding moves that rule out the
+        # solutions found so far (backjumps never go below it, or those
+        # solutions would be found again)
+        self.conflict = None
+        self.floor = 0
+        # nogoods (frozensets of 'set' moves), and the nogoods of every
+        # 'set' move
+        self.nogoods = OrderedDict()
+        self.nogood_index = {}
+        # (execute and rewind are replaced by their learning versions,
+        # so the search pays nothing for it when learning is off)
+        if learning:
+            self.execute = self.execute_learning
+            self.rewind = self.backjump
+
+        # search in progress (see iter_search): solution limit, number
+        # of solutions kept, solutions found so far
+        self.search_limit = 2
+        self.search_keep = 1
+        self.found_count = 0
+        self.found = []
+        self.searching = False
+
+        # budget of the running search (see solve): deadline (in
+        # perf_counter seconds), maximum moves and cancellation token
+        self.deadline = None
+        self.max_steps = None
+        self.cancel = None
+
+        # loads the puzzle (None leaves an empty grid, for a solver
+        # that will only be fed through reset())
+        self.given_count = 0
+        if puzzle is not None:
+            self.reset(puzzle)
+
+    def reset(self, puzzle = None):
+        """
+        Loads a new puzzle into the solver, so that a single instance
+        can solve many puzzles in a row without reallocating its
+        buffers. Puzzles can be given as lists of rows or as lines (see
+        parse_line); None loads an empty grid. The caller's
+        puzzle is never modified, and an invalid one (see
+        validate_input) is rejected before the solver's state is
+        touched.
+        Returns the solver itself, so resets can be chained with solve()
+        """
         # validates input
-        self.validate_input()
-        
-        # validates consistency
-        if not self.check_consistency():
-            raise ValueError("Input grid contains repeats")
-        
-    def check_consistency(self):
-        """
-        Checks if there exist repeats in the puzzle (i.e. repeated 
-        values in rows/columns/boxes).
-        Returns True if the puzzle is repeat-free, and False otherwise
-        """
-        puzzle = self.puzzle
-        for i in range (0,9):
-            # check for rows
-            amount = [0,0,0,0,0,0,0,0,0,0]
-            for j in range(0,9):
-                amount[puzzle[i][j]] += 1
-                if puzzle[i][j] > 0 and amount[puzzle[i][j]] > 1:
-                    return False
-            # check for columns
-            amount = [0,0,0,0,0,0,0,0,0,0]
-            for j in range(0,9):
-                amount[puzzle[j][i]] += 1
-                if puzzle[j][i] > 0 and amount[puzzle[j][i]] > 1:
-                    return False
-            # check for boxes
-            amount = [0,0,0,0,0,0,0,0,0,0]
-            first_col = (i%3)*3
-            first_row = (i//3)*3
-            for r in range(first_row, first_row+3):
-                for c in range(first_col, first_col+3):
-                    amount[puzzle[r][c]] += 1
-                    if puzzle[r][c] > 0 and amount[puzzle[r][c]] > 1:
+        if puzzle is None:
+            values = self.empty_grid
+        elif isinstance(puzzle, (str, bytes, bytearray, memoryview)):
+            values = parse_line(puzzle, self.box_size)
+        else:
+            self.validate_input(puzzle)
+            values = [element for row in puzzle for element in row]
+
+        # "set" moves for the givens, to get all deductions possible
+        # from them, checking for repeats before anything is cleared,
+        # so a rejected puzzle leaves the solver as it was (values
+        # already seen in every row, column and box, as bit masks)
+        givens = []
+        size = self.size
+        seen = [0]*(3*size)
+        for cell in range(self.cell_count):
+            val = values[cell]
+            if val > 0:
+                bit = 1 << val
+                row = self.row_of[cell]
+                col = size + self.col_of[cell]
+                box = 2*size + self.box_of[cell]
+                if (seen[row] | seen[col] | seen[box]) & bit:
+                    raise ValueError("Input grid contains repeats")
+                seen[row] |= bit
+                seen[col] |= bit
+                seen[box] |= bit
+                givens.append((cell << CELL_SHIFT) | (val << 1) | SET)
+
+        # back to the starting state
+        self.grid[:] = self.empty_grid
+        self.assigned = 0
+        self.cands[:] = self.full_cands
+        for units in (self.rows, self.cols, self.boxes):
+            for unit in units:
+                unit[:] = self.full_unit
+        del self.trail[:]
+        del self.bifurcations[:]
+        self.index = 0
+        self.stats = SolveStats()
+        self.found_count = 0
+        self.found = []
+        self.searching = False
+        del self.reasons[:]
+        self.conflict = None
+        self.floor = 0
+        self.nogoods.clear()
+        self.nogood_index.clear()
+
+        # the givens' moves stay at the bottom of the move stack
+        self.trail.extend(givens)
+        self.given_count = len(givens)
+        return self
+
+    def restart(self):
+        """
+        Takes the solver back to the state reset() left it in: the
+        givens stacked, nothing run or learned yet, and fresh counters.
+        solve(), count_solutions(), is_unique() and iter_search() start
+        with it, so queries on the same solver never pick up where the
+        last one stopped (search() and resume() do, on purpose).
+        Returns the solver itself
+        """
+        trail = self.trail
+        if self.index > 0 or len(trail) > self.given_count or self.bifurcations:
+            givens = trail[:self.given_count]
+            # undoing is bookkeeping, not search: the tracer is left out
+            tracer = self.tracer
+            self.tracer = None
+            try:
+                self.undo_to(0)
+            finally:
+                self.tracer = tracer
+            trail.extend(givens)
+        self.stats = SolveStats()
+        self.found_count = 0
+        self.found = []
+        self.searching = False
+        # nogoods are forgotten too, as by reset()
+        self.conflict = None
+        self.floor = 0
+        self.nogoods.clear()
+        self.nogood_index.clear()
+        return self
+
+    def snapshot(self):
+        """
+        Returns a copy of the solver's full state: grid, candidate and
+        unit masks, move stack, bifurcations, work counters, learned
+        nogoods and the search in progress (see iter_search). It is made
+        of plain lists, arrays and numbers, so it can be pickled and
+        loaded with restore() into any solver of the same box size and
+        learning mode, in this process or another one
+        """
+        return {
+            "box_size": self.box_size,
+            "learning": self.learning,
+            "grid": self.grid.copy(),
+            "assigned": self.assigned,
+            "cands": self.cands.copy(),
+            "rows": [unit.copy() for unit in self.rows],
+            "cols": [unit.copy() for unit in self.cols],
+            "boxes": [unit.copy() for unit in self.boxes],
+            "trail": array('H', self.trail),
+            "index": self.index,
+            "bifurcations": array('I', self.bifurcations),
+            "given_count": self.given_count,
+            "stats": copy.deepcopy(self.stats),
+            "search": (self.search_limit, self.search_keep, self.found_count,
+                       [[row.copy() for row in grid] for grid in self.found], self.searching),
+            "learned": (list(self.reasons), self.rem_reasons.copy(), self.set_reasons.copy(), self.conflict,
+                        self.floor, list(self.nogoods)),
+        }
+
+    def restore(self, state):
+        """
+        Loads a state saved by snapshot() into the solver's buffers (the
+        state itself is left untouched, so it can be restored again).
+        Returns the solver itself, so that resume() can be chained.
+        Raises ValueError if the state was saved by a solver of another
+        box size or learning mode
+        """
+        if state.get("box_size") != self.box_size:
+            raise ValueError(f"Snapshot of a box size {state.get('box_size')} solver, "
+                             f"cannot be restored into a box size {self.box_size} one")
+        if state.get("learning") != self.learning:
+            raise ValueError(f"Snapshot of a solver with learning={state.get('learning')}, "
+                             f"cannot be restored into one with learning={self.learning}")
+        self.grid[:] = state["grid"]
+        self.assigned = state["assigned"]
+        self.cands[:] = state["cands"]
+        for units, saved in ((self.rows, state["rows"]), (self.cols, state["cols"]), (self.boxes, state["boxes"])):
+            for unit, saved_unit in zip(units, saved):
+                unit[:] = saved_unit
+        del self.trail[:]
+        self.trail.extend(state["trail"])
+        self.index = state["index"]
+        del self.bifurcations[:]
+        self.bifurcations.extend(state["bifurcations"])
+        self.given_count = state["given_count"]
+        self.stats = copy.deepcopy(state["stats"])
+        limit, keep, count, found, searching = state["search"]
+        self.search_limit = limit
+        self.search_keep = keep
+        self.found_count = count
+        self.found = [[row.copy() for row in grid] for grid in found]
+        self.searching = searching
+        reasons, rem_reasons, set_reasons, conflict, floor, nogoods = state["learned"]
+        self.reasons[:] = reasons
+        self.rem_reasons[:] = rem_reasons
+        self.set_reasons[:] = set_reasons
+        self.conflict = conflict
+        self.floor = floor
+        self.nogoods.clear()
+        self.nogood_index.clear()
+        for nogood in nogoods:
+            self.nogoods[nogood] = None
+            for move in nogood:
+                self.nogood_index.setdefault(move, set()).add(nogood)
+        return self
+
+    def check_consistency(self, grid = None):
+        """
+        Checks if there exist repeats in the current grid, or in the
+        given flattened grid (i.e. repeated values in rows/columns/boxes).
+        Returns True if the grid is repeat-free, and False otherwise
+        """
+        if grid is None:
+            grid = self.grid
+        for unit in self.units:
+            seen = 0
+            for cell in unit:
+                if grid[cell] > 0:
+                    bit = 1 << grid[cell]
+                    if seen & bit:
                         return False
+                    seen |= bit
         return True
 
-    def validate_input(self):
+    def validate_input(self, puzzle):
         """
         Checks if the input is a valid sudoku grid:
-        - checks if the puzzle is a 9x9 grid
-        - checks if every entry is an integer in range(10)
+        - checks if the puzzle is a size x size grid
+        - checks if every entry is an integer in range(size+1)
         Returns an error if an inconsistency is found
         """
-        if len(self.puzzle) != 9:
-            raise TypeError("Sudoku grid must be 9x9")
-        for row in self.puzzle:
-            if len(row) != 9:
-                raise TypeError("Sudoku grid must be 9x9")
+        size = self.size
+        if len(puzzle) != size:
+            raise TypeError(f"Sudoku grid must be {size}x{size}")
+        values = range(size + 1)
+        for row in puzzle:
+            if len(row) != size:
+                raise TypeError(f"Sudoku grid must be {size}x{size}")
             for element in row:
-                if element not in range(10):
-                    raise ValueError("Sudoku cells must contain numbers from 0 (unassigned) to 9")
-    
-    def execute_set(self, instruction):
+                if element not in values:
+                    raise ValueError(f"Sudoku cells must contain numbers from 0 (unassigned) to {size}")
+
+    def execute_set(self, move):
         """
-        Executes a 'set' function, which sets a specific cell of the
+        Executes a 'set' move, which sets a specific cell of the
         grid to a value. Also updates the assigned counter.
-        - Returns a list of 'rem' instructions corresponding to elements
-          in the same row/box/column as the set cell for the cell's
-          new value, as well as the set cell for values different from
-          its new value
+        - Stacks 'rem' moves corresponding to elements in the same
+          row/box/column as the set cell for the cell's new value, as
+          well as the set cell for values different from its new value
+        Returns False if the move contradicts the grid, True otherwise
         """
+        cell = move >> CELL_SHIFT
+        val = (move >> 1) & VALUE_MASK
         # do not repeat instruction if it has already been executed
-        if self.puzzle[instruction[1]][instruction[2]] == instruction[3]:
-            return []
-            
-        # if the cell is already set to something else, then an 
+        if self.grid[cell] == val:
+            return True
+
+        # if the cell is already set to something else, then an
         # inconsistency occurred at some point in the execution
-        elif self.puzzle[instruction[1]][instruction[2]] > 0:
-            if self.verbose:
-                print(f"Set ERROR: {instruction[1]},{instruction[2]} is already set to {self.puzzle[instruction[1]][instruction[2]]}! Can't set it to {instruction[3]}!")
-            # must reduce index by 1 so move does not get undone
-            self.index -= 1
-            return ["ERROR"]
-        if self.verbose:
-            print(f"Setting {instruction[1]},{instruction[2]} to {instruction[3]}.")
-        self.puzzle[instruction[1]][instruction[2]] = instruction[3]
+        elif self.grid[cell] > 0:
+            if self.tracer is not None:
+                self.tracer.on_clash(self.row_of[cell], self.col_of[cell], val, self.grid[cell])
+            return False
+        if self.tracer is not None:
+            self.tracer.on_set(self.row_of[cell], self.col_of[cell], val)
+        self.grid[cell] = val
         self.assigned += 1
-            
-        stack_to_add = []
-        
-        # REM instructions: for self
-        for v in range(1,10):
-            if v != instruction[3]:
-                if self.possibilities[instruction[1]][instruction[2]][v]:
-                    stack_to_add.append(("rem",instruction[1],instruction[2],v))
-        
-        # REM instructions: for row
-        i = instruction[1]
-        for j in range(0,9):
-            if j != instruction[2]:
-                if self.possibilities[i][j][instruction[3]]:
-                    stack_to_add.append(("rem",i,j,instruction[3]))
-        
-        # REM instruction: for column
-        j = instruction[2]
-        for i in range(0,9):
-            if i != instruction[1]:
-                if self.possibilities[i][j][instruction[3]]:
-                    stack_to_add.append(("rem",i,j,instruction[3]))
-        
-        # REM instruction: for box
-        start_r = 3*(instruction[1]//3)
-        start_c = 3*(instruction[2]//3)
-        for i in range(start_r, start_r+3):
-            for j in range(start_c, start_c+3):
-                if i != instruction[1] or j != instruction[2]:
-                    if self.possibilities[i][j][instruction[3]]:
-                        stack_to_add.append(("rem",i,j,instruction[3]))
-        
-        return stack_to_add 
-        
+        self.stats.sets += 1
+
+        trail = self.trail
+        row = self.row_of[cell]
+        col = self.col_of[cell]
+
+        # REM moves: for self
+        others = self.cands[cell] & ~(1 << (val-1))
+        while others:
+            low = others & -others
+            others ^= low
+            trail.append((cell << CELL_SHIFT) | (low.bit_length() << 1) | REM)
+
+        # REM moves: for row
+        rem_val = (val << 1) | REM
+        others = self.rows[row][val] & ~(1 << col)
+        while others:
+            low = others & -others
+            others ^= low
+            trail.append((self.row_cells[row][low.bit_length()-1] << CELL_SHIFT) | rem_val)
+
+        # REM moves: for column
+        others = self.cols[col][val] & ~(1 << row)
+        while others:
+            low = others & -others
+            others ^= low
+            trail.append((self.col_cells[col][low.bit_length()-1] << CELL_SHIFT) | rem_val)
+
+        # REM moves: for box (cells sharing the row or column with the
+        # set cell were already covered above)
+        box_cells = self.box_cells[self.box_of[cell]]
+        others = self.boxes[self.box_of[cell]][val]
+        while others:
+            low = others & -others
+            others ^= low
+            other = box_cells[low.bit_length()-1]
+            if self.row_of[other] != row and self.col_of[other] != col:
+                trail.append((other << CELL_SHIFT) | rem_val)
+
+        return True
+
+    def set_single(self, cell, val, unit_name):
+        """
+        given the only cell of a unit that can take a certain value,
+        stack a 'set' move for that cell and that value, unless said
+        cell already has that value.
+        Returns False if the cell has a different value, True otherwise
+        """
+        if self.grid[cell] == val:
+            return True
+        if self.grid[cell] > 0:
+            return False
+        if self.tracer is not None:
+            self.tracer.on_single(self.row_of[cell], self.col_of[cell], val, unit_name)
+        self.trail.append((cell << CELL_SHIFT) | (val << 1) | SET)
+        return True
+
     def set_box(self, box, val):
         """
-        given a box with only one cell that can take a certain 
-        value, return a 'set' instruction for that cell and that value,
-        unless said cell either already has that value (None), or has a
-        different value (ERROR)
-        """
-        # if a hidden single exists, find the corresponding cell
-        start_r = 3*(box//3)
-        start_c = 3*(box%3)
-        for row in range(start_r,start_r+3):
-            for col in range(start_c,start_c+3):
-                if self.possibilities[row][col][val]:
-                    if self.puzzle[row][col] == val:
-                        return None
-                    if self.puzzle[row][col] > 0:
-                        return "ERROR"
-                    if self.verbose:
-                        print(f"Hidden single found! Cell {row},{col} only cell in box for {val}")
-                    return ("set",row,col,val)
-        
+        given a box with only one cell that can take a certain
+        value, stack a 'set' move for that cell and that value (see
+        set_single)
+        """
+        # if a hidden single exists, the lowest bit of the box mask
+        # points to the corresponding cell
+        return self.set_single(self.box_cells[box][lowest_bit(self.boxes[box][val])], val, "box")
+
     def set_col(self, col, val):
         """
-        given a column with only one cell that can take a certain 
-        value, return a 'set' instruction for that cell and that value,
-        unless said cell either already has that value (None), or has a
-        different value (ERROR)
-        """
-        # if a hidden single exists, find the corresponding cell
-        for row in range(9):
-            if self.possibilities[row][col][val]:
-                if self.puzzle[row][col] == val:
-                    return None
-                if self.puzzle[row][col] > 0:
-                    return "ERROR"
-                if self.verbose:
-                    print(f"Hidden single found! Cell {row},{col} only cell in column for {val}")
-                return ("set",row,col,val)
-        
+        given a column with only one cell that can take a certain
+        value, stack a 'set' move for that cell and that value (see
+        set_single)
+        """
+        return self.set_single(self.col_cells[col][lowest_bit(self.cols[col][val])], val, "column")
+
     def set_row(self, row, val):
         """
-        given a row with only one cell that can take a certain 
-        value, return a 'set' instruction for that cell and that value,
-        unless said cell either already has that value (None), or has a
-        different value (ERROR)
-        """
-        # if a hidden single exists, find the corresponding cell
-        for col in range(9):
-            if self.possibilities[row][col][val]:
-                if self.puzzle[row][col] == val:
-                    return None
-                if self.puzzle[row][col] > 0:
-                    return "ERROR"
-                if self.verbose:
-                    print(f"Hidden single found! Cell {row},{col} only cell in row for {val}")
-                return ("set",row,col,val)
-        
-    def execute_rem(self, instruction):
+        given a row with only one cell that can take a certain
+        value, stack a 'set' move for that cell and that value (see
+        set_single)
+        """
+        return self.set_single(self.row_cells[row][lowest_bit(self.rows[row][val])], val, "row")
+
+    def execute_rem(self, move):
         """
         remove a value from the list of possibiliites of a cell.
-        also updates the possibility arrays for the cell's 
-        row/column/box
+        also updates the possibility arrays for the cell's
+        row/column/box.
+        Returns False if the removal leaves a cell or unit without
+        options, True otherwise
         """
+        cell = move >> CELL_SHIFT
+        val = (move >> 1) & VALUE_MASK
+        bit = 1 << (val-1)
         # prevent re-execution
-        if not self.possibilities[instruction[1]][instruction[2]][instruction[3]]:
-            return []
-            
+        if not self.cands[cell] & bit:
+            return True
+
         # carry out instructions
-        if self.verbose:
-            print(f"Removing {instruction[3]} from possibilities for {instruction[1]},{instruction[2]}.")          
-        self.possibilities[instruction[1]][instruction[2]][instruction[3]] = False
-        self.rows[instruction[1]][instruction[3]] -= 1
-        self.cols[instruction[2]][instruction[3]] -= 1
-        box = 3*(instruction[1]//3)+(instruction[2]//3)
-        self.boxes[box][instruction[3]] -= 1
-        
+        row = self.row_of[cell]
+        col = self.col_of[cell]
+        box = self.box_of[cell]
+        if self.tracer is not None:
+            self.tracer.on_rem(row, col, val)
+        self.stats.rems += 1
+        cell_mask = self.cands[cell] ^ bit
+        self.cands[cell] = cell_mask
+        row_mask = self.rows[row][val] & ~(1 << col)
+        self.rows[row][val] = row_mask
+        col_mask = self.cols[col][val] & ~(1 << row)
+        self.cols[col][val] = col_mask
+        box_mask = self.boxes[box][val] & ~(1 << self.box_pos[cell])
+        self.boxes[box][val] = box_mask
+
         # CHECK ALL LOGICAL INCONSISTENCIES!
-        if sum(self.possibilities[instruction[1]][instruction[2]]) < 2:
-            if self.verbose:
-                print(f"Rem ERROR: cell {instruction[1]},{instruction[2]} is out of options!")
-            return ["ERROR"]
-        if self.rows[instruction[1]][instruction[3]] == 0:
-            if self.verbose:
-                print(f"Rem ERROR: row {instruction[1]} has no place for {instruction[3]}!")
-            return ["ERROR"]
-        if self.cols[instruction[2]][instruction[3]] == 0:
-            if self.verbose:
-                print(f"Rem ERROR: column {instruction[2]} has no place for {instruction[3]}!")
-            return ["ERROR"]
-        if self.boxes[box][instruction[3]] == 0:
-            if self.verbose:
-                print(f"Rem ERROR: box {box} has no place for {instruction[3]}!")
-            return ["ERROR"]
-        
-        return []
-        
+        if cell_mask == 0:
+            if self.tracer is not None:
+                self.tracer.on_conflict("cell", row, col, val)
+            return False
+        if row_mask == 0:
+            if self.tracer is not None:
+                self.tracer.on_conflict("row", row, col, val)
+            return False
+        if col_mask == 0:
+            if self.tracer is not None:
+                self.tracer.on_conflict("column", row, col, val)
+            return False
+        if box_mask == 0:
+            if self.tracer is not None:
+                self.tracer.on_conflict("box", row, col, val)
+            return False
+
+        # STACK THE SINGLES THIS REMOVAL CREATED!
+        # (this is the only moment a cell or a unit can go down to a
+        # single option, so no full-grid sweep is needed afterwards)
+        if popcount(cell_mask) == 1 and self.grid[cell] == 0:
+            if self.tracer is not None:
+                self.tracer.on_single(row, col, cell_mask.bit_length(), "cell")
+            self.trail.append((cell << CELL_SHIFT) | (cell_mask.bit_length() << 1) | SET)
+        if popcount(row_mask) == 1 and not self.set_row(row, val):
+            return False
+        if popcount(col_mask) == 1 and not self.set_col(col, val):
+            return False
+        if popcount(box_mask) == 1 and not self.set_box(box, val):
+            return False
+
+        return True
+
     def check_singles(self):
         """
-        Checks for naked and hidden singles in the grid.
-        Returns 'set' instructions for found singles.
+        Checks for naked and hidden singles in the whole grid, stacking
+        'set' moves for found singles.
+        Returns False if a contradiction was found, True otherwise
+
+        execute_rem already stacks every single as soon as it appears,
+        so this sweep is only used as a cross-check in debug mode
         """
-        instructions_to_add = []
+        trail = self.trail
         # check for naked single
-        for i in range(9):
-            for j in range(9):
-                if sum(self.possibilities[i][j]) == 2 and self.puzzle[i][j] < 1:
-                    k = [a for a in range(1,10) if self.possibilities[i][j][a]][0]
-                    instructions_to_add.append(("set",i,j,k))
-        
+        for cell in range(self.cell_count):
+            mask = self.cands[cell]
+            if popcount(mask) == 1 and self.grid[cell] < 1:
+                trail.append((cell << CELL_SHIFT) | (mask.bit_length() << 1) | SET)
+
         # check for hidden single
-        for row in range(9):
-            for value in range(1,10):
-                if self.rows[row][value] == 1:
-                    inst = self.set_row(row,value)
-                    if inst is not None:
-                        if inst == "ERROR":
-                            return ["ERROR"]
-                        else:
-                            instructions_to_add.append(inst)
-        for col in range(9):
-            for value in range(1,10):
-                if self.cols[col][value] == 1:
-                    inst = self.set_col(col,value)
-                    if inst is not None:
-                        if inst == "ERROR":
-                            return ["ERROR"]
-                        else:
-                            instructions_to_add.append(inst)
-        for box in range(9):
-            for value in range(1,10):
-                if self.boxes[box][value] == 1:
-                    inst = self.set_box(box,value)
-                    if inst is not None:
-                        if inst == "ERROR":
-                            return ["ERROR"]
-                        else:
-                            instructions_to_add.append(inst)
-        return instructions_to_add
-    
-    def execute(self, instruction):
-        """
-        checks whether instruction is 'set' or 'rem' to call the correct
+        for row in range(self.size):
+            for value in range(1, self.size + 1):
+                if popcount(self.rows[row][value]) == 1:
+                    if not self.set_row(row,value):
+                        return False
+        for col in range(self.size):
+            for value in range(1, self.size + 1):
+                if popcount(self.cols[col][value]) == 1:
+                    if not self.set_col(col,value):
+                        return False
+        for box in range(self.size):
+            for value in range(1, self.size + 1):
+                if popcount(self.boxes[box][value]) == 1:
+                    if not self.set_box(box,value):
+                        return False
+        return True
+
+    def stack_rems(self, cells, vals):
+        """
+        stacks 'rem' moves for the values in the vals mask from every
+        cell in cells, skipping the ones that are no longer possible.
+        Returns the number of moves stacked
+        """
+        trail = self.trail
+        count = 0
+        for cell in cells:
+            others = self.cands[cell] & vals
+            while others:
+                low = others & -others
+                others ^= low
+                trail.append((cell << CELL_SHIFT) | (low.bit_length() << 1) | REM)
+                count += 1
+        return count
+
+    def find_locked_candidates(self):
+        """
+        pointing: if the cells of a box that can take a value are all
+        in one row/column, the value can be removed from the rest of
+        that row/column.
+        box-line reduction: if the cells of a row/column that can take
+        a value are all in one box, the value can be removed from the
+        rest of that box.
+        Returns the number of 'rem' moves stacked
+        """
+        n = self.box_size
+        values = range(1, self.size + 1)
+        found = 0
+        for box in range(self.size):
+            for val in values:
+                mask = self.boxes[box][val]
+                i = self.locked_box_row[mask]
+                if i >= 0:
+                    row = n*(box//n) + i
+                    outside = self.rows[row][val] & ~self.line_box_bits[box%n]
+                    if outside:
+                        found += self.stack_rems([self.row_cells[row][lowest_bit(m)] for m in bits_of(outside)], 1 << (val-1))
+                i = self.locked_box_col[mask]
+                if i >= 0:
+                    col = n*(box%n) + i
+                    outside = self.cols[col][val] & ~self.line_box_bits[box//n]
+                    if outside:
+                        found += self.stack_rems([self.col_cells[col][lowest_bit(m)] for m in bits_of(outside)], 1 << (val-1))
+        for line in range(self.size):
+            for val in values:
+                # row line, inside the k-th box of the row
+                k = self.locked_line_box[self.rows[line][val]]
+                if k >= 0:
+                    box = n*(line//n) + k
+                    outside = self.boxes[box][val] & ~self.box_row_bits[line%n]
+                    if outside:
+                        found += self.stack_rems([self.box_cells[box][lowest_bit(m)] for m in bits_of(outside)], 1 << (val-1))
+                # column line, inside the k-th box of the column
+                k = self.locked_line_box[self.cols[line][val]]
+                if k >= 0:
+                    box = n*k + line//n
+                    outside = self.boxes[box][val] & ~self.box_col_bits[line%n]
+                    if outside:
+                        found += self.stack_rems([self.box_cells[box][lowest_bit(m)] for m in bits_of(outside)], 1 << (val-1))
+        return found
+
+    def find_naked_subsets(self, size):
+        """
+        naked subsets: if size unset cells of a unit can only take size
+        values between them, those values can be removed from the other
+        cells of the unit.
+        Returns the number of 'rem' moves stacked
+        """
+        found = 0
+        for unit in self.units:
+            open_cells = [cell for cell in unit if self.grid[cell] == 0]
+            if len(open_cells) <= size:
+                continue
+            small = [cell for cell in open_cells if popcount(self.cands[cell]) <= size]
+            for subset in combinations(small, size):
+                vals = 0
+                for cell in subset:
+                    vals |= self.cands[cell]
+                if popcount(vals) == size:
+                    found += self.stack_rems([cell for cell in open_cells if cell not in subset], vals)
+        return found
+
+    def find_hidden_subsets(self, size):
+        """
+        hidden subsets: if size values of a unit can only go in size
+        cells between them, every other value can be removed from those
+        cells.
+        Returns the number of 'rem' moves stacked
+        """
+        found = 0
+        for masks, cells in ((self.rows, self.row_cells), (self.cols, self.col_cells), (self.boxes, self.box_cells)):
+            for unit in range(self.size):
+                unit_masks = masks[unit]
+                open_vals = [val for val in range(1, self.size + 1) if 2 <= popcount(unit_masks[val]) <= size]
+                for subset in combinations(open_vals, size):
+                    places = 0
+                    vals = 0
+                    for val in subset:
+                        places |= unit_masks[val]
+                        vals |= 1 << (val-1)
+                    if popcount(places) == size:
+                        found += self.stack_rems([cells[unit][lowest_bit(m)] for m in bits_of(places)], self.all_values & ~vals)
+        return found
+
+    def find_fish(self, size):
+        """
+        fish (X-wing for size 2, swordfish for size 3): if the places
+        for a value in size rows all lie in the same size columns, the
+        value can be removed from the rest of those columns (and the
+        same with rows and columns swapped).
+        Returns the number of 'rem' moves stacked
+        """
+        found = 0
+        for val in range(1, self.size + 1):
+            bit = 1 << (val-1)
+            for base, cover, cover_cells in ((self.rows, self.cols, self.col_cells), (self.cols, self.rows, self.row_cells)):
+                lines = [line for line in range(self.size) if 2 <= popcount(base[line][val]) <= size]
+                for subset in combinations(lines, size):
+                    places = 0
+                    line_bits = 0
+                    for line in subset:
+                        places |= base[line][val]
+                        line_bits |= 1 << line
+                    if popcount(places) != size:
+                        continue
+                    for m in bits_of(places):
+                        other = lowest_bit(m)
+                        targets = cover[other][val] & ~line_bits
+                        found += self.stack_rems([cover_cells[other][lowest_bit(t)] for t in bits_of(targets)], bit)
+        return found
+
+    def find_naked_pairs(self):
+        return self.find_naked_subsets(2)
+
+    def find_hidden_pairs(self):
+        return self.find_hidden_subsets(2)
+
+    def find_naked_triples(self):
+        return self.find_naked_subsets(3)
+
+    def find_hidden_triples(self):
+        return self.find_hidden_subsets(3)
+
+    def find_x_wing(self):
+        return self.find_fish(2)
+
+    def find_swordfish(self):
+        return self.find_fish(3)
+
+    def execute(self, move):
+        """
+        checks whether move is 'set' or 'rem' to call the correct
         execution method
         """
-        if instruction[0] == "set":
-            return self.execute_set(instruction)
-        elif instruction[0] == "rem":
-            return self.execute_rem(instruction)
-            
-    def undo_rem(self, instruction):
+        if move & 1:
+            return self.execute_rem(move)
+        return self.execute_set(move)
+
+    def undo_rem(self, move):
         """
-        undoes the effects of a 'rem' instruction
+        undoes the effects of a 'rem' move
         """
-        if self.possibilities[instruction[1]][instruction[2]][instruction[3]]:
+        cell = move >> CELL_SHIFT
+        val = (move >> 1) & VALUE_MASK
+        bit = 1 << (val-1)
+        if self.cands[cell] & bit:
             return
-        
-        # undo rem: remembering to re-increment the possibility variables
-        self.possibilities[instruction[1]][instruction[2]][instruction[3]] = True
-        self.rows[instruction[1]][instruction[3]] += 1
-        self.cols[instruction[2]][instruction[3]] += 1
-        box = 3*(instruction[1]//3)+(instruction[2]//3)
-        self.boxes[box][instruction[3]] += 1
-        
-    def undo_set(self, instruction):
-        """
-        undoes the effects of a 'set' instruction
-        """
-        if self.puzzle[instruction[1]][instruction[2]] == 0:
+
+        # undo rem: remembering to restore the unit masks
+        self.cands[cell] |= bit
+        self.rows[self.row_of[cell]][val] |= 1 << self.col_of[cell]
+        self.cols[self.col_of[cell]][val] |= 1 << self.row_of[cell]
+        self.boxes[self.box_of[cell]][val] |= 1 << self.box_pos[cell]
+
+    def undo_set(self, move):
+        """
+        undoes the effects of a 'set' move
+        """
+        cell = move >> CELL_SHIFT
+        # a set that clashed with a different value was never applied
+        if self.grid[cell] != (move >> 1) & VALUE_MASK:
             return
-            
+
         # undo set: remembering to decrement the assigned variable
-        self.puzzle[instruction[1]][instruction[2]] = 0
+        self.grid[cell] = 0
         self.assigned -= 1
-        
-    def undo(self, instruction):
+
+    def undo(self, move):
         """
-        checks whether instruction is 'set' or 'rem' to call the correct
+        checks whether move is 'set' or 'rem' to call the correct
         undoing method
         """
-        if self.verbose:
-            print(f"Undoing type {instruction[0]}, cell {instruction[1]},{instruction[2]}, value {instruction[3]}")
-        if instruction[0] == "set":
-            self.undo_set(instruction)
-        elif instruction[0] == "rem":
-            self.undo_rem(instruction)
-            
+        if self.tracer is not None:
+            op, cell, val = decode_move(move)
+            self.tracer.on_undo(op, self.row_of[cell], self.col_of[cell], val)
+        if move & 1:
+            self.undo_rem(move)
+        else:
+            self.undo_set(move)
+
     def rewind(self):
         """
         rewinds the puzzle's state back to the latest bifurcation, by
-        undoing all instructions done after said bifurcation.
-        
-        also stacks a 'rem' instruction for the value attempted in the
-        bifurcation, so the algorithm can try something else
-        """
-        if self.index >= len(self.instructions):
-            self.index = len(self.instructions) - 1
-        if self.verbose:
-            print("<<< REWIND STARTING")
+        undoing all moves done after said bifurcation (including the
+        one that raised a contradiction, if any).
+
+        also stacks a 'rem' move for the value attempted in the
+        bifurcation, so the algorithm can try something else.
+        Returns True (see backjump for the learning version)
+        """
+        trail = self.trail
+        if self.index >= len(trail):
+            self.index = len(trail) - 1
+        start = perf_counter()
+        self.stats.rewinds += 1
+        if self.tracer is not None:
+            self.tracer.on_rewind(len(self.bifurcations))
         # backtracks to the last bifurcation
         last_one = self.bifurcations.pop()
         while self.index >= last_one:
-            self.undo(self.instructions[self.index])
+            self.undo(trail[self.index])
             self.index -= 1
         self.index += 1
-        
+
         # remove the bifurcated possibility, as it led to a
-        # contradiction (or to test another potential solution)
-        bifurc_step = self.instructions[self.index]
-        new_command = ("rem",bifurc_step[1],bifurc_step[2],bifurc_step[3])        
-        self.instructions = self.instructions[:last_one]
-        self.instructions.append(new_command)
-        
+        # contradiction (or to test another potential solution).
+        # the move stack is truncated in place
+        new_move = trail[last_one] | REM
+        del trail[last_one:]
+        trail.append(new_move)
+        self.stats.time_rewind += perf_counter() - start
+        return True
+
+    def branch_cell(self):
+        """
+        returns the unset cell to bifurcate on.
+        Heuristic used: the most restricted candidate
+        """
+        cur_candidate = 0
+        cur_poss = self.size + 1
+        for cell in range(self.cell_count):
+            if self.grid[cell] == 0:
+                poss = popcount(self.cands[cell])
+                if poss < cur_poss:
+                    cur_poss = poss
+                    cur_candidate = cell
+        return cur_candidate
+
+    def propagate(self):
+        """
+        runs the stacked moves and the inference rules until nothing is
+        left to deduce, without ever bifurcating (the move stack must
+        hold no bifurcations).
+        Returns False if a contradiction was reached, and True otherwise
+        (the grid is then either complete or waiting for a bifurcation)
+        """
+        trail = self.trail
+        while True:
+            while self.index < len(trail):
+                self.stats.moves += 1
+                if not self.execute(trail[self.index]):
+                    return False
+                self.index += 1
+            if self.assigned == self.cell_count:
+                return True
+            for name, rule in self.rules:
+                if rule():
+                    break
+            if len(trail) <= self.index:
+                return True
+
+    def assume(self, moves):
+        """
+        Stacks moves on top of a propagated state (with no
+        bifurcations) and propagates them (see propagate), so they can
+        be taken back later without starting over from the givens.
+        Returns the move stack position to pass to undo_to() to take
+        them back, or None if they led to a contradiction (they are then
+        already taken back)
+        """
+        position = len(self.trail)
+        for move in moves:
+            # moves that would change nothing are left out, as undoing
+            # them would take back what the moves below them did
+            cell = move >> CELL_SHIFT
+            if move & 1:
+                if self.cands[cell] & (1 << (((move >> 1) & VALUE_MASK) - 1)):
+                    self.trail.append(move)
+            elif self.grid[cell] != (move >> 1) & VALUE_MASK:
+                self.trail.append(move)
+        if self.propagate():
+            return position
+        self.undo_to(position)
+        return None
+
+    def undo_to(self, position):
+        """
+        undoes every move from position up the move stack (including
+        the one that raised a contradiction, if any), and drops them
+        along with their bifurcations: the solver goes back to the
+        state it was in when the move at position was stacked
+        """
+        trail = self.trail
+        if self.index >= position:
+            index = min(self.index, len(trail) - 1)
+            while index >= position:
+                self.undo(trail[index])
+                index -= 1
+            self.index = position
+        del trail[position:]
+        while self.bifurcations and self.bifurcations[-1] >= position:
+            self.bifurcations.pop()
+        if self.learning:
+            del self.reasons[position:]
+
     def bifurcate(self):
         """
         selects an unset cell with the minimum amount of possibilities,
-        stacks a 'set' instruction for its lowest possible value, and
+        stacks a 'set' move for its lowest possible value, and
         marks it as a bifurcation (to be undone later by a rewind)
         """
         # chooses a candidate for bifurcation
-        # Heuristic used: the most restricted candidate
-        cur_candidate = (0,0)
-        cur_poss = 11
-        for i in range(9):
-            for j in range(9):
-                if self.puzzle[i][j] == 0:
-                    poss = sum(self.possibilities[i][j])
-                    if poss < cur_poss:
-                        cur_poss = poss
-                        cur_candidate = (i,j)
-                        
-        for i in range(1,10):
-            if self.possibilities[cur_candidate[0]][cur_candidate[1]][i]:
-                self.instructions.append(("set",cur_candidate[0],cur_candidate[1],i))
-                self.bifurcations.append(len(self.instructions)-1)
-                break
-        
-    def solve(self):
+        cur_candidate = self.branch_cell()
+
+        # tries the lowest possible value first (or a random one)
+        mask = self.cands[cur_candidate]
+        if mask:
+            if self.rng is None:
+                val = lowest_bit(mask)+1
+            else:
+                val = self.rng.choice(bits_of(mask)).bit_length()
+            if self.learning:
+                # a guess only depends on itself
+                self.sync_reasons()
+                self.reasons.append(1 << (len(self.bifurcations) + 1))
+            self.bifurcations.append(len(self.trail))
+            self.trail.append((cur_candidate << CELL_SHIFT) | (val << 1) | SET)
+            stats = self.stats
+            stats.bifurcations += 1
+            if len(self.bifurcations) > stats.max_depth:
+                stats.max_depth = len(self.bifurcations)
+            if self.tracer is not None:
+                self.tracer.on_bifurcate(self.row_of[cur_candidate], self.col_of[cur_candidate], val, len(self.bifurcations))
+
+    # --- CONFLICT LEARNING (see learning in __init__)
+
+    def sync_reasons(self):
+        """
+        gives the moves stacked outside of execute (givens, inference
+        rules, extra givens of split_search) their levels: every
+        bifurcation made so far
+        """
+        missing = len(self.trail) - len(self.reasons)
+        if missing > 0:
+            self.reasons.extend([(1 << (len(self.bifurcations) + 1)) - 2]*missing)
+
+    def execute_learning(self, move):
+        """
+        execute(), keeping track of the levels every move depends on:
+        moves stacked by a 'set' depend on what it depends on, singles
+        on the removals that left a single option, and contradictions on
+        the moves that caused them (kept in self.conflict for backjump)
+        """
+        self.sync_reasons()
+        reason = self.reasons[self.index]
+        if move & 1:
+            return self._learning_rem(move, reason)
+        return self._learning_set(move, reason)
+
+    def _learning_set(self, move, reason):
+        """
+        executes a 'set' move for execute_learning, then looks for
+        nogoods it leaves with a single guess to go
+        """
+        cell = move >> CELL_SHIFT
+        current = self.grid[cell]
+        before = len(self.trail)
+        if not self.execute_set(move):
+            # the cell holds another value
+            self.conflict = reason | self.set_reasons[cell]
+            return False
+        if current:
+            return True
+        self.set_reasons[cell] = reason
+        self.reasons.extend([reason]*(len(self.trail) - before))
+        watched = self.nogood_index.get(move)
+        if watched:
+            return self._check_nogoods(watched)
+        return True
+
+    def _check_nogoods(self, watched):
+        """
+        for every nogood with a single assignment left to hold, stacks a
+        'rem' move against it (or reports a contradiction if they all
+        hold already)
+        """
+        grid = self.grid
+        cands = self.cands
+        for nogood in list(watched):
+            pending = None
+            why = 0
+            idle = False
+            for other in nogood:
+                cell = other >> CELL_SHIFT
+                val = (other >> 1) & VALUE_MASK
+                if grid[cell] == val:
+                    why |= self.set_reasons[cell]
+                elif pending is None and grid[cell] == 0 and cands[cell] & (1 << (val-1)):
+                    pending = other
+                else:
+                    # already broken, or 2 assignments left
+                    idle = True
+                    break
+            if idle:
+                continue
+            self.nogoods.move_to_end(nogood)
+            self.stats.nogood_prunes += 1
+            if pending is None:
+                self.conflict = why
+                return False
+            self.trail.append(pending | REM)
+            self.reasons.append(why)
+        return True
+
+    def _learning_rem(self, move, reason):
+        """
+        executes a 'rem' move for execute_learning
+        """
+        cell = move >> CELL_SHIFT
+        val = (move >> 1) & VALUE_MASK
+        if not self.cands[cell] & (1 << (val-1)):
+            return True
+        self.rem_reasons[cell*self.size + val - 1] = reason
+        trail = self.trail
+        before = len(trail)
+        if not self.execute_rem(move):
+            self.conflict = self._rem_conflict(cell, val)
+            return False
+        for position in range(before, len(trail)):
+            self.reasons.append(self._single_reason(trail[position], cell, val))
+        return True
+
+    def _unit_reason(self, cells, val, skip = -1):
+        """
+        levels of the removals of val from the cells of a unit (but skip)
+        """
+        rem_reasons = self.rem_reasons
+        size = self.size
+        why = 0
+        for cell in cells:
+            if cell != skip:
+                why |= rem_reasons[cell*size + val - 1]
+        return why
+
+    def _cell_reason(self, cell, skip = 0):
+        """
+        levels of the removals of every value (but skip) from a cell
+        """
+        size = self.size
+        why = 0
+        for val in range(1, size + 1):
+            if val != skip:
+                why |= self.rem_reasons[cell*size + val - 1]
+        return why
+
+    def _units_of(self, cell, val):
+        """
+        returns (value mask, cells) for the row, column and box of a cell
+        """
+        row = self.row_of[cell]
+        col = self.col_of[cell]
+        box = self.box_of[cell]
+        return ((self.rows[row][val], self.row_cells[row]), (self.cols[col][val], self.col_cells[col]),
+                (self.boxes[box][val], self.box_cells[box]))
+
+    def _single_reason(self, single, cell, val):
+        """
+        levels of a single stacked by the removal of val from cell
+        """
+        target = single >> CELL_SHIFT
+        if target == cell:
+            # naked single: every other value left the cell
+            return self._cell_reason(cell, (single >> 1) & VALUE_MASK)
+        # hidden single: val left every other cell of one of the units
+        for mask, cells in self._units_of(cell, val):
+            if popcount(mask) == 1 and cells[lowest_bit(mask)] == target:
+                return self._unit_reason(cells, val, target)
+        return (1 << (len(self.bifurcations) + 1)) - 2
+
+    def _rem_conflict(self, cell, val):
+        """
+        levels of the contradiction reached by removing val from cell
+        """
+        if self.cands[cell] == 0:
+            return self._cell_reason(cell)
+        units = self._units_of(cell, val)
+        for mask, cells in units:
+            if mask == 0:
+                return self._unit_reason(cells, val)
+        # a hidden single pointing to a cell holding another value
+        for mask, cells in units:
+            if popcount(mask) == 1:
+                target = cells[lowest_bit(mask)]
+                if self.grid[target] not in (0, val):
+                    return self._unit_reason(cells, val, target) | self.set_reasons[target]
+        return (1 << (len(self.bifurcations) + 1)) - 2
+
+    def learn_nogood(self, nogood):
+        """
+        records a nogood (frozenset of 'set' moves), evicting the least
+        recently used one past max_nogoods
         """
-        main solver algorithm. Attempts to complete the grid contained 
-        in self.puzzle. Returns the complete grid if a solution exists
+        if nogood in self.nogoods:
+            self.nogoods.move_to_end(nogood)
+            return
+        self.nogoods[nogood] = None
+        for move in nogood:
+            self.nogood_index.setdefault(move, set()).add(nogood)
+        self.stats.nogoods += 1
+        if len(self.nogoods) > self.max_nogoods:
+            old, _ = self.nogoods.popitem(last = False)
+            for move in old:
+                self.nogood_index[move].discard(old)
+
+    def backjump(self):
+        """
+        Learning version of rewind: the last contradiction depends on a
+        set of bifurcation levels. The deepest of them (the culprit)
+        is undone together with every level above it, and a 'rem' move
+        for its value is stacked at the deepest of the others, where it
+        already holds. The culprit's guesses are recorded as a nogood.
+        After a solution, rewinds chronologically (and later backjumps
+        stay above that level).
+        Returns False if the contradiction depends on no bifurcation
+        at all (the search is over), True otherwise
+        """
+        trail = self.trail
+        bifurcations = self.bifurcations
+        if self.index >= len(trail):
+            self.index = len(trail) - 1
+        start = perf_counter()
+        stats = self.stats
+        depth = len(bifurcations)
+        conflict = self.conflict
+        self.conflict = None
+        after_solution = conflict is None
+        if after_solution:
+            conflict = (1 << (depth + 1)) - 2
+        if conflict == 0:
+            return False
+
+        stats.rewinds += 1
+        if self.tracer is not None:
+            self.tracer.on_rewind(depth)
+        culprit = conflict.bit_length() - 1
+        learned = conflict ^ (1 << culprit)
+        target = learned.bit_length() - 1 if learned else 0
+        if culprit > self.floor:
+            target = max(target, self.floor)
+        # the 'rem' move stacked below rules the solution out
+        self.floor = target if after_solution else min(self.floor, target)
+        stats.backjumps += depth - 1 - target
+        guess = trail[bifurcations[culprit - 1]]
+        # (nothing is learned from the rewinds after a solution)
+        levels = bits_of(conflict)
+        if not after_solution and self.max_nogoods > 0 and 2 <= len(levels) <= self.max_nogood_size:
+            self.learn_nogood(frozenset(trail[bifurcations[bit.bit_length() - 2]] for bit in levels))
+
+        # backtracks to the target level
+        cut = bifurcations[target]
+        while self.index >= cut:
+            self.undo(trail[self.index])
+            self.index -= 1
+        self.index += 1
+        del trail[cut:]
+        del self.reasons[cut:]
+        del bifurcations[target:]
+        trail.append(guess | REM)
+        self.reasons.append(learned)
+        stats.time_rewind += perf_counter() - start
+        return True
+
+    # ---------------------------------
+
+    def solve(self, with_stats = False, engine = "moves", timeout = None, max_steps = None, cancel = None):
+        """
+        main solver algorithm. Attempts to complete the grid contained
+        in self.grid. Returns the complete grid if a solution exists
         and is unique, and otherwise raises errors.
+        With with_stats, returns a (solution, SolveStats) tuple instead
+        (the counters are also kept in self.stats when errors are raised)
+        engine picks the search engine (see ENGINES)
+        The search can be bounded, raising BudgetExceededError (with the
+        counters so far) when it runs out:
+        - timeout: seconds the search may take
+        - max_steps: moves the search may take (nodes for "dlx")
+        - cancel: token checked during the search, that cancels it once
+          its is_set() returns True (threading.Event, multiprocessing.Event)
+        Every call searches the puzzle from its givens (see restart), so
+        it can follow any other query on the same solver, even one that
+        ran out of budget
+        """
+        count, solutions = self._timed_search(2, 1, engine, timeout, max_steps, cancel)
+        solution = self._unique_solution(count, solutions)
+        if with_stats:
+            return solution, self.stats
+        return solution
+
+    def _unique_solution(self, count, solutions):
+        """
+        returns the solution of a puzzle with count solutions, raising
+        errors if it is not unique
+        """
+        if count == 0:
+            raise UnsolvableError("Puzzle is unsolvable")
+        if count >= 2:
+            raise MultipleSolutionsError("Puzzle has multiple solutions!")
+        return solutions[0]
+
+    def solution(self):
+        """
+        returns the outcome of a finished iter_search() with the
+        default limits: the solution if it is unique, raising errors
+        as solve() does otherwise
+        """
+        if self.searching:
+            raise RuntimeError("The search is not finished")
+        return self._unique_solution(self.found_count, self.found)
+
+    def count_solutions(self, limit = None, keep = None, engine = "moves", timeout = None, max_steps = None, cancel = None):
+        """
+        Counts the solutions of the puzzle, stopping as soon as limit
+        solutions are found (None counts them all).
+        Returns a (count, solutions) tuple, where solutions holds the
+        first keep solutions found (all of them if keep is None).
+        Never raises for unsolvable or multi-solution puzzles (budgets
+        work as in solve)
+        """
+        return self._timed_search(limit, keep, engine, timeout, max_steps, cancel)
+
+    def is_unique(self, engine = "moves", timeout = None, max_steps = None, cancel = None):
+        """
+        Returns True if the puzzle has exactly one solution, stopping
+        the search at the second one (budgets work as in solve)
+        """
+        return self._timed_search(2, 0, engine, timeout, max_steps, cancel)[0] == 1
+
+    def _timed_search(self, limit, keep, engine, timeout = None, max_steps = None, cancel = None):
+        """
+        runs the search of the chosen engine from the givens, with the
+        bookkeeping of the total time and of the search budget
+        """
+        stats = self.restart().stats
+        started = perf_counter()
+        self.deadline = None if timeout is None else started + timeout
+        self.max_steps = None if max_steps is None else stats.moves + max_steps
+        self.cancel = cancel
+        try:
+            if engine == "moves":
+                return self.search(limit, keep)
+            elif engine == "dlx":
+                return self.search_dlx(limit, keep)
+            raise ValueError(f"Unknown engine: {engine}")
+        finally:
+            self.deadline = None
+            self.max_steps = None
+            self.cancel = None
+            stats.time_total += perf_counter() - started
+
+    def budgeted(self):
+        """
+        returns True if the running search has a budget to check
+        """
+        return self.deadline is not None or self.max_steps is not None or self.cancel is not None
+
+    def check_budget(self, steps):
+        """
+        Raises BudgetExceededError if the running search, having taken
+        steps moves in total, ran out of its budget.
+        Returns the number of moves it may take before the next check
+        """
+        if self.cancel is not None and self.cancel.is_set():
+            raise BudgetExceededError("cancelled", self.stats)
+        if self.deadline is not None and perf_counter() >= self.deadline:
+            raise BudgetExceededError("timeout", self.stats)
+        if self.max_steps is not None:
+            left = self.max_steps - steps
+            if left <= 0:
+                raise BudgetExceededError("max_steps", self.stats)
+            return min(left, BUDGET_CHECK_INTERVAL)
+        return BUDGET_CHECK_INTERVAL
+
+    def search_dlx(self, limit, keep):
+        """
+        same as search(), on the exact cover engine: the givens are
+        read back from the bottom of the move stack, and the grid and
+        move stack are left untouched
+        """
+        if self.dlx is None:
+            self.dlx = DancingLinks(self.box_size)
+        givens = [(move >> CELL_SHIFT, (move >> 1) & VALUE_MASK) for move in self.trail[:self.given_count]]
+        check = None
+        if self.budgeted():
+            # the budget counts the moves of earlier searches too
+            base = self.stats.moves
+
+            def check(nodes):
+                return self.check_budget(base + nodes)
+        count, grids = self.dlx.search(givens, limit, keep, self.stats, check)
+        solutions = [self.rows_of(grid) for grid in grids]
+        if self.tracer is not None:
+            for solution in solutions:
+                self.tracer.on_solution(solution)
+        return count, solutions
+
+    def search(self, limit, keep):
+        """
+        runs the move stack until limit solutions were found (None for
+        no limit) or the whole search tree was explored, bifurcating
+        whenever logic alone gets stuck, and rewinding after every
+        solution to look for the next one.
+        Returns the number of solutions found and the first keep of them
+        (as lists of rows; all of them if keep is None).
+        The search carries on from the current state of the move stack
+        (see assume; the entry points that start over from the givens
+        are solve, count_solutions, is_unique and iter_search)
         """
-        solution = [[0 for _ in range(9)] for _ in range(9)]
-        # force "set" instructions for givens, to get all deductions
-        # possible from them
-        for i in range(9):
-            for j in range(9):
-                if self.puzzle[i][j] > 0:
-                    self.instructions.append(("set",i,j,self.puzzle[i][j]))
-                    self.puzzle[i][j] = 0
-                    
-        stop = False
-        solutions = 0
-        # outermost loop: stops when puzzle is solved or impossible
-        while stop == False:
+        for _ in self._start_search(limit, keep):
+            pass
+        return self.found_count, self.found
+
+    def iter_search(self, limit = 2, keep = 1):
+        """
+        Step-by-step version of search() (the defaults are solve()'s):
+        returns a generator that yields "propagation" after every batch
+        of moves taken off the move stack, "bifurcation" after every
+        guess and "solution" after every solution found (but the last).
+        The search can be paused between steps, saved with snapshot()
+        and carried on later with resume(), here or in another solver.
+        Once exhausted, the results are in found_count and found (see
+        search, and solution() for solve()'s outcome).
+        Like solve(), it starts over from the givens (see restart)
+        """
+        self.restart()
+        return self._start_search(limit, keep)
+
+    def _start_search(self, limit, keep):
+        """
+        sets up a search with the given limits from the current state,
+        returning its generator (see resume)
+        """
+        self.search_limit = limit
+        self.search_keep = keep
+        self.found_count = 0
+        self.found = []
+        self.searching = True
+        return self.resume()
+
+    def resume(self):
+        """
+        generator carrying on the search started by iter_search (the
+        state between two steps is entirely held by the solver, so this
+        also picks up a search loaded by restore())
+        """
+        if not self.searching:
+            return self.found_count, self.found
+        trail = self.trail
+        stats = self.stats
+        limit = self.search_limit
+        keep = self.search_keep
+        solutions = self.found
+        # (the "set" moves for the givens were stacked by reset)
+
+        # moves left before the next budget check (never reached
+        # without a budget)
+        if self.budgeted():
+            next_check = self.check_budget(stats.moves)
+        else:
+            next_check = -1
+
+        # outermost loop: stops when the limit is reached or the
+        # puzzle runs out of possibilities
+        while True:
             # inner loop: stops when no logical deductions are left
-            while self.index < len(self.instructions):
-                if self.instructions[self.index] != "ERROR":
-                    new_commands = self.execute(self.instructions[self.index])
-                else:
-                    new_commands = [self.instructions.pop()]
-                if new_commands and new_commands[0] == "ERROR":
-                    if len(self.bifurcations) > 0:
-                        self.rewind()
-                    else:
-                        # if an error was raised without any bifurcations,
-                        # then the puzzle reached an unsolvable state via
-                        # logic deductions alone, implying it is unsolvable
-                        # (or the removal of previously valid solutions
-                        # made it unsolvable)
-                        stop = True
-                        break
-                else:
-                    self.instructions.extend(new_commands)
+            phase_start = perf_counter()
+            rewind_time = stats.time_rewind
+            moves = 0
+            stop = False
+            while self.index < len(trail):
+                if moves == next_check:
+                    # brings the counters up to date for the check
+                    stats.moves += moves
+                    moves = 0
+                    next_check = self.check_budget(stats.moves)
+                moves += 1
+                if self.execute(trail[self.index]):
                     self.index += 1
-            solution_found = False
-            if self.assigned == 81:
-                # if all 81 cells are assigned, a solution was found.
+                elif not (len(self.bifurcations) > 0 and self.rewind()):
+                    # if a contradiction was found without any
+                    # bifurcations (or, with learning, one that does
+                    # not depend on any of them), then the puzzle
+                    # reached an unsolvable state via logic deductions
+                    # alone, meaning every solution was already found
+                    # (if any)
+                    stop = True
+                    break
+            stats.moves += moves
+            if next_check > 0:
+                next_check -= moves
+            stats.time_propagation += perf_counter() - phase_start - (stats.time_rewind - rewind_time)
+            if stop:
+                self.searching = False
+                return self.found_count, solutions
+            yield "propagation"
+            if self.assigned == self.cell_count:
+                # if all cells are assigned, a solution was found.
                 # given that no repeats are ever placed into the grid
                 # by the solution algorithm, then we know this solution
                 # to be consistent
-                if self.verbose:
-                    print("SOLUTION FOUND!")
-                    for i in range(9):
-                        print(self.puzzle[i])
-                    print("--------")
-                solution_found = True
-                solutions += 1
-                if solutions >= 2:
-                    raise ValueError("Puzzle has multiple solutions!")
-                # if this is the first solution found, register it
-                for i in range(9):
-                    for j in range(9):
-                        solution[i][j] = self.puzzle[i][j]
-                # if this solution was found without bifurcations,
-                # then the puzzle is uniquely solvable
-                if len(self.bifurcations) == 0:
-                    if self.verbose:
-                        for i in range(9):
-                            print(self.puzzle[i])
-                    return solution
-                else:
-                    self.rewind()
-            else:
-                # no more instructions: check for naked and hidden 
-                # singles. 
-                more_instructions = self.check_singles()
-                self.instructions.extend(more_instructions)
-                # --- EXTRA INFERENCE RULES GO HERE
-                # (none so far)
-                # ---------------------------------
-                
+                self.found_count += 1
+                if self.tracer is not None:
+                    self.tracer.on_solution(self.rows_of(self.grid))
+                if keep is None or len(solutions) < keep:
+                    solutions.append(self.rows_of(self.grid))
+                # if this solution was found without bifurcations, then
+                # there is nothing else to explore
+                if self.found_count == limit or len(self.bifurcations) == 0:
+                    self.searching = False
+                    return self.found_count, solutions
+                # otherwise, undo the last bifurcation to look for the
+                # next solution
+                self.rewind()
+                yield "solution"
+                continue
+
+            # no more moves: naked and hidden singles were already
+            # stacked by execute_rem, so only the debug sweep runs
+            phase_start = perf_counter()
+            if self.debug:
+                if not self.check_singles() or len(trail) > self.index:
+                    raise RuntimeError("Incremental propagation missed a single")
+            # --- EXTRA INFERENCE RULES GO HERE
+            # (the first rule that finds something stops the pipeline,
+            # so the cheaper rules get another go after propagation)
+            for name, rule in self.rules:
+                found = rule()
+                if found:
+                    stats.rule_hits[name] = stats.rule_hits.get(name, 0) + 1
+                    stats.rule_rems[name] = stats.rule_rems.get(name, 0) + found
+                    if self.tracer is not None:
+                        self.tracer.on_rule(name, found)
+                    break
+            # ---------------------------------
+            stats.time_inference += perf_counter() - phase_start
+
             # BIFURCATION BELOW
-            # (the instruction pointer has run out of instructions, no
-            # new naked/hidden singles were found, and no new solution
-            # was found)
-            if len(self.instructions) <= self.index and not solution_found:
-                if self.verbose:
-                    print("Out of logical steps. Attempting bifurcation.")
+            # (the instruction pointer has run out of moves, so no new
+            # naked/hidden singles are left, and no new solution was
+            # found)
+            if len(trail) <= self.index:
+                phase_start = perf_counter()
                 self.bifurcate()
-        if solutions == 0:
-            raise ValueError("Puzzle is unsolvable")
-        return solution
-        
-                    
-if __name__ == '__main__':
+                stats.time_bifurcation += perf_counter() - phase_start
+                yield "bifurcation"
+
+
+def rule_report(puzzles, rules = INFERENCE_RULES):
+    """
+    Measures how much each inference rule cuts the search: solves the
+    puzzles with no rules, with each rule alone and with all of them.
+    Returns a dictionary mapping "none", each rule name and "all" to
+    the total bifurcations, rewinds, candidates removed by the rules and
+    solving time over the puzzles (puzzles that fail are counted too)
+    """
+    puzzles = list(puzzles)
+    report = {}
+    setups = [("none", ())] + [(name, (name,)) for name in rules] + [("all", tuple(rules))]
+    for label, setup in setups:
+        problem = SudokuProblem(rules = setup)
+        totals = {"bifurcations": 0, "rewinds": 0, "rule_rems": 0, "time": 0.0}
+        for puzzle in puzzles:
+            try:
+                problem.reset(puzzle).solve()
+            except ValueError:
+                pass
+            stats = problem.stats
+            totals["bifurcations"] += stats.bifurcations
+            totals["rewinds"] += stats.rewinds
+            totals["rule_rems"] += sum(stats.rule_rems.values())
+            totals["time"] += stats.time_total
+        report[label] = totals
+    return report
+
+
+# outcomes of a puzzle solved in a batch (see SolveResult)
+SOLVED = "solved"
+UNSOLVABLE = "unsolvable"
+MULTIPLE = "multiple"
+INVALID = "invalid"
+BUDGET = "budget"
+
+
+class SolveResult:
+    """
+    Outcome of one puzzle solved by solve_many:
+    - index: position of the puzzle in the input
+    - status: SOLVED, UNSOLVABLE, MULTIPLE, INVALID or BUDGET (the
+      search ran out of its timeout/max_steps)
+    - solution: the completed grid (None unless SOLVED)
+    - error: the error message (None if SOLVED)
+    - stats: SolveStats of the run (None if the input was invalid)
+    """
+
+    def __init__(self, index, status, solution = None, error = None, stats = None):
+        self.index = index
+        self.status = status
+        self.solution = solution
+        self.error = error
+        self.stats = stats
+
+    @property
+    def ok(self):
+        return self.status == SOLVED
+
+    def __repr__(self):
+        return f"SolveResult(index={self.index}, status={self.status!r}, error={self.error!r})"
+
+
+def solve_one(puzzle, index = 0, problem = None, engine = "moves", timeout = None, max_steps = None, box_size = 3):
+    """
+    solves a single puzzle, turning the errors raised by SudokuProblem
+    into a SolveResult instead of propagating them.
+    Pass a SudokuProblem as problem to reuse its buffers, and a timeout
+    (seconds) or max_steps (moves) to bound the search (see solve).
+    box_size is only used to build a solver when problem is None
+    """
+    try:
+        if problem is None:
+            problem = SudokuProblem(puzzle, box_size = box_size)
+        else:
+            problem.reset(puzzle)
+    except Exception as error:
+        return SolveResult(index, INVALID, error = str(error))
+    try:
+        solution = problem.solve(engine = engine, timeout = timeout, max_steps = max_steps)
+    except BudgetExceededError as error:
+        return SolveResult(index, BUDGET, error = str(error), stats = error.stats)
+    except UnsolvableError as error:
+        return SolveResult(index, UNSOLVABLE, error = str(error), stats = problem.stats)
+    except MultipleSolutionsError as error:
+        return SolveResult(index, MULTIPLE, error = str(error), stats = problem.stats)
+    return SolveResult(index, SOLVED, solution = solution, stats = problem.stats)
+
+
+def _solve_chunk(chunk, engine = "moves", timeout = None, max_steps = None, box_size = 3):
+    """
+    worker entry point: solves a list of (index, puzzle) pairs
+    """
+    problem = SudokuProblem(box_size = box_size)
+    return [solve_one(puzzle, index, problem, engine, timeout, max_steps) for index, puzzle in chunk]
+
+
+def _chunks(items, size):
+    """
+    groups an iterable into lists of at most size elements
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _run_chunks(func, chunks, workers, ordered):
+    """
+    applies func to every chunk on a pool of workers, yielding the
+    return values (in chunk order if ordered is set). At most 2 chunks
+    per worker are in flight at any time
+    """
+    if workers <= 1:
+        for chunk in chunks:
+            yield func(chunk)
+        return
+
+    window = 2*workers
+    with Pool(workers) as pool:
+        if ordered:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.apply_async(func, (chunk,)))
+                if len(pending) >= window:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+        else:
+            # workers report finished chunks (or a crash) through a queue
+            done = queue.Queue()
+            in_flight = 0
+            for chunk in chunks:
+                pool.apply_async(func, (chunk,), callback = done.put, error_callback = done.put)
+                in_flight += 1
+                if in_flight >= window:
+                    yield _finished_chunk(done.get())
+                    in_flight -= 1
+            while in_flight:
+                yield _finished_chunk(done.get())
+                in_flight -= 1
+
+
+def solve_many(puzzles, workers = None, chunksize = 64, ordered = True, engine = "moves", timeout = None, max_steps = None,
+               box_size = 3):
+    """
+    Solves an iterable of puzzles, yielding one SolveResult per puzzle.
+    - workers: number of worker processes (defaults to the number of
+      cores; 1 solves everything in the calling process)
+    - chunksize: puzzles sent to a worker at a time, to amortize the
+      inter-process communication
+    - ordered: yield results in input order, or as soon as they are
+      done (use SolveResult.index to match them to their puzzles)
+    - engine: search engine (see ENGINES)
+    - timeout, max_steps: budget of every puzzle's search (see solve);
+      puzzles that run out of it get the BUDGET status
+    - box_size: grid geometry of the puzzles (3 for 9x9, 4 for 16x16...)
+    Errors never abort the batch: they are reported in the results.
+    The input is consumed lazily, with at most 2 chunks per worker in
+    flight, so it can be a generator over an arbitrarily large source
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    chunks = _chunks(enumerate(puzzles), chunksize)
+    solve_chunk = partial(_solve_chunk, engine = engine, timeout = timeout, max_steps = max_steps, box_size = box_size)
+    for results in _run_chunks(solve_chunk, chunks, workers, ordered):
+        yield from results
+
+
+def _finished_chunk(results):
+    """
+    returns the results of a chunk, re-raising a worker crash
+    """
+    if isinstance(results, BaseException):
+        raise results
+    return results
+
+
+def split_search(puzzle, tasks, rules = DEFAULT_RULES, box_size = 3, limit = 2):
+    """
+    Splits the search tree of a single puzzle at its first branch
+    points (breadth first, one child per candidate of the most
+    constrained cell) until at least tasks subtrees are open, the tree
+    is exhausted, or limit solutions were found (None for no limit).
+    Returns the puzzle as a line (see parse_line), the open subtrees (as
+    lists of (cell, value) assignments on top of the givens) and the
+    solutions found while splitting (flattened grids)
+    """
+    problem = SudokuProblem(puzzle, rules = rules, box_size = box_size)
+    grid = problem.empty_grid.copy()
+    for move in problem.trail[:problem.given_count]:
+        grid[move >> CELL_SHIFT] = (move >> 1) & VALUE_MASK
+    line = format_line(grid)
+
+    solutions = []
+    frontier = deque([[]])
+    while frontier and len(frontier) < tasks and (limit is None or len(solutions) < limit):
+        assignments = frontier.popleft()
+        _load_subtree(problem, line, assignments)
+        if not problem.propagate():
+            continue
+        if problem.assigned == problem.cell_count:
+            solutions.append(problem.grid.copy())
+            continue
+        cell = problem.branch_cell()
+        for bit in bits_of(problem.cands[cell]):
+            frontier.append(assignments + [(cell, bit.bit_length())])
+    return line, list(frontier), solutions
+
+
+def _load_subtree(problem, line, assignments):
+    """
+    loads a puzzle into a solver, with the assignments of a subtree
+    stacked (and counted) as extra givens
+    """
+    problem.reset(line)
+    for cell, val in assignments:
+        problem.trail.append((cell << CELL_SHIFT) | (val << 1) | SET)
+    problem.given_count = len(problem.trail)
+
+
+def _search_subtree(task):
+    """
+    worker entry point: counts the solutions of one subtree of
+    split_search, up to a limit
+    """
+    line, assignments, limit, rules, engine, box_size = task
+    problem = SudokuProblem(rules = rules, box_size = box_size)
+    _load_subtree(problem, line, assignments)
+    count, solutions = problem.count_solutions(limit, 1, engine)
+    return count, solutions
+
+
+def search_parallel(puzzle, limit = 2, workers = None, tasks_per_worker = 16, rules = DEFAULT_RULES, engine = "moves",
+                    box_size = 3):
+    """
+    Counts the solutions of a single puzzle on a pool of workers,
+    stopping as soon as limit solutions are found (None counts them
+    all): the search tree is split (see split_search) into about
+    tasks_per_worker subtrees per worker, which are handed out one at
+    a time as workers free up, so an unbalanced tree keeps every core
+    busy. Reaching the limit terminates the pool.
+    Returns the number of solutions found (at most limit) and the first
+    of them, as in count_solutions(limit, keep = 1)
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    line, subtrees, found = split_search(puzzle, workers*tasks_per_worker, rules, box_size, limit)
+    count = len(found)
+    solutions = [geometry(box_size).rows_of(found[0])] if found else []
+    if limit is not None and count >= limit:
+        subtrees = []
+    tasks = ((line, assignments, limit, rules, engine, box_size) for assignments in subtrees)
+
+    if workers <= 1:
+        results = map(_search_subtree, tasks)
+        pool = None
+    else:
+        pool = Pool(workers)
+        results = pool.imap_unordered(_search_subtree, tasks)
+    try:
+        for sub_count, sub_solutions in results:
+            count += sub_count
+            if not solutions:
+                solutions = sub_solutions
+            if limit is not None and count >= limit:
+                break
+    finally:
+        if pool is not None:
+            # stops the subtrees still being searched
+            pool.terminate()
+            pool.join()
+    if limit is not None:
+        count = min(count, limit)
+    return count, solutions
+
+
+def solve_parallel(puzzle, workers = None, tasks_per_worker = 16, rules = DEFAULT_RULES, engine = "moves", box_size = 3):
+    """
+    same as SudokuProblem(puzzle).solve(), searching the tree of the
+    puzzle on a pool of workers (see search_parallel)
+    """
+    count, solutions = search_parallel(puzzle, 2, workers, tasks_per_worker, rules, engine, box_size)
+    if count == 0:
+        raise UnsolvableError("Puzzle is unsolvable")
+    if count >= 2:
+        raise MultipleSolutionsError("Puzzle has multiple solutions!")
+    return solutions[0]
+
+
+def read_puzzle_lines(path, keep_all = False):
+    """
+    Yields the puzzle lines (as bytes) of a one-puzzle-per-line file.
+    The file is memory-mapped, so it is read in constant memory
+    whatever its size. Blank lines and lines starting with '#' are
+    skipped, unless keep_all is set (see _skipped_line), so that the
+    n-th line yielded is the n-th line of the file
+    """
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ) as buffer:
+            start = 0
+            size = len(buffer)
+            while start < size:
+                end = buffer.find(b"\n", start)
+                if end < 0:
+                    end = size
+                line = buffer[start:end].strip()
+                start = end + 1
+                if keep_all or not _skipped_line(line):
+                    yield line
+
+
+def _skipped_line(line):
+    """
+    tells blank lines and '#' comment lines of a puzzle file apart from
+    puzzle lines
+    """
+    return not line or line.startswith(b"#")
+
+
+def format_result(result):
+    """
+    returns the output line of a SolveResult: the solution as a line
+    (see parse_line), or the status for puzzles that could not be solved
+    """
+    if result.status == SOLVED:
+        return format_line([element for row in result.solution for element in row])
+    return result.status
+
+
+def _solve_line_chunk(chunk, engine = "moves", timeout = None, max_steps = None, box_size = 3):
+    """
+    worker entry point: solves a list of puzzle lines, returning the
+    output lines as a single block of bytes and the number of puzzles
+    per status. Blank and comment lines are copied to the output as
+    they are, so output lines stay aligned with input lines
+    """
+    lines = []
+    counts = {}
+    problem = SudokuProblem(box_size = box_size)
+    for line in chunk:
+        if _skipped_line(line):
+            lines.append(line)
+            continue
+        result = solve_one(line, problem = problem, engine = engine, timeout = timeout, max_steps = max_steps)
+        counts[result.status] = counts.get(result.status, 0) + 1
+        lines.append(format_result(result).encode("ascii"))
+    lines.append(b"")
+    return b"\n".join(lines), counts
+
+
+def solve_file(in_path, out_path, workers = None, chunksize = 256, engine = "moves", timeout = None, max_steps = None,
+               box_size = 3):
+    """
+    Solves every puzzle of a one-puzzle-per-line file (see
+    read_puzzle_lines), writing one line per puzzle to out_path ('-'
+    for stdout), in input order (see format_result). Blank and '#'
+    lines are copied as they are, so line n of the output always
+    answers line n of the input. Output is written
+    one chunk at a time, so memory use does not depend on the file size.
+    timeout and max_steps bound every puzzle's search (see solve), and
+    box_size gives the grid geometry of the puzzles.
+    Returns the number of puzzles per status
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    totals = {}
+    chunks = _chunks(read_puzzle_lines(in_path, keep_all = True), chunksize)
+    out = sys.stdout.buffer if out_path == "-" else open(out_path, "wb")
+    try:
+        solve_chunk = partial(_solve_line_chunk, engine = engine, timeout = timeout, max_steps = max_steps, box_size = box_size)
+        for block, counts in _run_chunks(solve_chunk, chunks, workers, True):
+            out.write(block)
+            for status, count in counts.items():
+                totals[status] = totals.get(status, 0) + count
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+        else:
+            out.flush()
+    return totals
+
+
+def main(argv = None):
+    """
+    command-line entry point:
+        python -m SudokuProblem solve in.txt out.txt [--workers N] [--engine dlx]
+            [--timeout SECONDS] [--max-steps MOVES] [--box-size N]
+    with no arguments, solves a sample puzzle step by step
+    """
+    parser = argparse.ArgumentParser(prog = "python -m SudokuProblem")
+    commands = parser.add_subparsers(dest = "command")
+    solve_parser = commands.add_parser("solve", help = "solve a file of puzzle lines")
+    solve_parser.add_argument("input", help = "one puzzle per line, '0' or '.' for blanks")
+    solve_parser.add_argument("output", help = "one solution (or status) per line, '-' for stdout")
+    solve_parser.add_argument("--workers", type = int, default = None, help = "worker processes (default: one per core)")
+    solve_parser.add_argument("--chunksize", type = int, default = 256, help = "puzzles per worker task")
+    solve_parser.add_argument("--engine", choices = ENGINES, default = "moves", help = "search engine")
+    solve_parser.add_argument("--timeout", type = float, default = None, help = "seconds allowed per puzzle")
+    solve_parser.add_argument("--max-steps", type = int, default = None, help = "moves allowed per puzzle")
+    solve_parser.add_argument("--box-size", type = int, default = 3, help = "box size of the puzzles (3 for 9x9, 4 for 16x16...)")
+    args = parser.parse_args(argv)
+
+    if args.command == "solve":
+        started = perf_counter()
+        totals = solve_file(args.input, args.output, workers = args.workers, chunksize = args.chunksize, engine = args.engine,
+                            timeout = args.timeout, max_steps = args.max_steps, box_size = args.box_size)
+        elapsed = perf_counter() - started
+        puzzles = sum(totals.values())
+        summary = ", ".join(f"{status}: {count}" for status, count in sorted(totals.items()))
+        print(f"{puzzles} puzzles in {elapsed:.2f}s ({summary})", file = sys.stderr)
+        return 0
+
     puzzle = [
           [6, 1, 8, 0, 0, 0, 3, 4, 2],
 [0, 0, 3, 6, 0, 1, 7, 0, 0],
@@ -475,8 +2271,14 @@ if __name__ == '__main__':
 [0, 2, 5, 3, 0, 9, 4, 0, 1],
 [7, 0, 0, 0, 0, 2, 0, 0, 3]
         ]
-    problem = SudokuProblem(puzzle)
-    if not problem.check_consistency():
+    problem = SudokuProblem(puzzle, verbose = True)
+    solution, stats = problem.solve(with_stats = True)
+    if not problem.check_consistency([element for row in solution for element in row]):
         raise ValueError("Final result is invalid")
-    solution = problem.solve()
     print("Concluded")
+    print(stats)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,325 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from time import perf_counter
+
+from SudokuProblem import ENGINES, SudokuProblem, format_result, solve_one
+
+# solver reused by every batch of a worker process
+_worker_problem = None
+
+
+def _solve_batch(lines, engine = "moves", timeout = None, max_steps = None, box_size = 3):
+    """
+    worker entry point: solves a batch of puzzle lines, returning one
+    (status, output line, moves, rewinds, bifurcations, solve seconds)
+    tuple per line
+    """
+    global _worker_problem
+    if _worker_problem is None or _worker_problem.box_size != box_size:
+        _worker_problem = SudokuProblem(box_size = box_size)
+    replies = []
+    for line in lines:
+        result = solve_one(line, problem = _worker_problem, engine = engine, timeout = timeout, max_steps = max_steps)
+        stats = result.stats
+        if stats is None:
+            replies.append((result.status, format_result(result), 0, 0, 0, 0.0))
+        else:
+            replies.append((result.status, format_result(result), stats.moves, stats.rewinds, stats.bifurcations,
+                            stats.time_total))
+    return replies
+
+
+class SolverService:
+    """
+    Solves puzzles submitted from asyncio code on a pool of worker
+    processes.
+    - requests are grouped into micro-batches of up to batch_size
+      puzzles, waiting at most batch_delay seconds for a batch to fill,
+      to amortize the inter-process communication
+    - at most max_pending requests wait for a batch, and at most 2
+      batches per worker are in flight: past that, submit() blocks,
+      pushing back on the callers (and on the network)
+    - counters holds the service totals (see stats())
+    """
+
+    def __init__(self, workers = None, batch_size = 32, batch_delay = 0.002, max_pending = 1024, engine = "moves",
+                 timeout = None, max_steps = None, box_size = 3):
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.max_pending = max_pending
+        self.engine = engine
+        self.timeout = timeout
+        self.max_steps = max_steps
+        self.box_size = box_size
+        self.counters = {
+            "received": 0,
+            "completed": 0,
+            "batches": 0,
+            "statuses": {},
+            "latency_ms_total": 0.0,
+            "latency_ms_max": 0.0,
+        }
+        self.executor = None
+        self.pending = None
+        self.in_flight = None
+        self.batcher = None
+
+    async def start(self):
+        """
+        starts the worker pool and the batching task
+        """
+        self.executor = ProcessPoolExecutor(self.workers)
+        self.pending = asyncio.Queue(self.max_pending)
+        self.in_flight = asyncio.Semaphore(2*self.workers)
+        self.batcher = asyncio.create_task(self._batch_loop())
+        # starts every worker process now, rather than on the first
+        # requests
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.executor, _solve_batch, []) for _ in range(self.workers)])
+
+    async def stop(self):
+        """
+        stops the batching task and shuts the worker pool down. Requests
+        not handed to a worker yet are cancelled, and the batches
+        running are waited for off the event loop, so their replies are
+        still delivered
+        """
+        self.batcher.cancel()
+        try:
+            await self.batcher
+        except asyncio.CancelledError:
+            pass
+        while not self.pending.empty():
+            _, future, _ = self.pending.get_nowait()
+            future.cancel()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, partial(self.executor.shutdown, cancel_futures = True))
+
+    async def submit(self, line):
+        """
+        Queues a puzzle line (waiting for room if max_pending requests
+        are already queued).
+        Returns a future resolving to the reply line: the solution or
+        status (see format_result), followed by the request's latency
+        and work counters
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.pending.put((line, future, perf_counter()))
+        self.counters["received"] += 1
+        return future
+
+    async def solve(self, line):
+        """
+        submits a puzzle line and waits for its reply line
+        """
+        return await (await self.submit(line))
+
+    async def _batch_loop(self):
+        """
+        collects queued requests into batches and hands them to the
+        workers, at most 2 batches per worker at a time
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.pending.get()]
+            try:
+                deadline = loop.time() + self.batch_delay
+                while len(batch) < self.batch_size:
+                    left = deadline - loop.time()
+                    if left <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self.pending.get(), left))
+                    except asyncio.TimeoutError:
+                        break
+                await self.in_flight.acquire()
+            except asyncio.CancelledError:
+                # stopped (see stop) before the batch reached the pool
+                for _, future, _ in batch:
+                    future.cancel()
+                raise
+            self.counters["batches"] += 1
+            lines = [line for line, _, _ in batch]
+            work = loop.run_in_executor(self.executor, _solve_batch, lines, self.engine, self.timeout, self.max_steps,
+                                        self.box_size)
+            work.add_done_callback(lambda done, batch = batch: self._finish_batch(batch, done))
+
+    def _finish_batch(self, batch, done):
+        """
+        resolves the futures of a finished batch, updating the counters
+        """
+        self.in_flight.release()
+        if done.cancelled():
+            # dropped by the pool shutting down (see stop)
+            for _, future, _ in batch:
+                future.cancel()
+            return
+        error = done.exception()
+        if error is not None:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        counters = self.counters
+        now = perf_counter()
+        for (_, future, received), reply in zip(batch, done.result()):
+            status, output, moves, rewinds, bifurcations, solve_time = reply
+            latency = 1000*(now - received)
+            counters["completed"] += 1
+            counters["statuses"][status] = counters["statuses"].get(status, 0) + 1
+            counters["latency_ms_total"] += latency
+            counters["latency_ms_max"] = max(counters["latency_ms_max"], latency)
+            if not future.done():
+                future.set_result(f"{output} latency_ms={latency:.3f} solve_ms={1000*solve_time:.3f} moves={moves} "
+                                  f"rewinds={rewinds} bifurcations={bifurcations}")
+
+    def stats(self):
+        """
+        returns the service counters, with the queue length and the mean
+        latency
+        """
+        stats = dict(self.counters)
+        stats["statuses"] = dict(stats["statuses"])
+        stats["queued"] = self.pending.qsize() if self.pending is not None else 0
+        completed = stats["completed"]
+        stats["latency_ms_mean"] = stats["latency_ms_total"]/completed if completed else 0.0
+        return stats
+
+    async def handle(self, reader, write):
+        """
+        Serves one line-delimited stream: every line is a puzzle (see
+        parse_line), answered with one reply line, in order. The line
+        STATS is answered with the service counters as JSON. Requests
+        are pipelined: the next line is read while the previous ones are
+        being solved. write is called with every reply line (as bytes).
+        (STATS replies hold the counters as of when the line was read)
+        """
+        replies = asyncio.Queue(self.max_pending)
+
+        async def send_replies():
+            while True:
+                reply = await replies.get()
+                if reply is None:
+                    return
+                if not isinstance(reply, str):
+                    try:
+                        reply = await reply
+                    except Exception as error:
+                        reply = f"error {error}"
+                await write(reply.encode("ascii") + b"\n")
+
+        sender = asyncio.create_task(send_replies())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                line = line.strip()
+                if not line:
+                    continue
+                if line == b"STATS":
+                    await replies.put(json.dumps(self.stats()))
+                else:
+                    await replies.put(await self.submit(line))
+            # waits for the replies still being solved
+            await replies.put(None)
+            await sender
+        finally:
+            sender.cancel()
+
+
+async def serve_tcp(service, host = "127.0.0.1", port = 8765):
+    """
+    serves the line protocol (see SolverService.handle) over TCP until
+    cancelled
+    """
+    async def client(reader, writer):
+        async def write(data):
+            writer.write(data)
+            await writer.drain()
+        try:
+            await service.handle(reader, write)
+        except (asyncio.CancelledError, ConnectionError):
+            # server shutting down, or client gone
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(client, host, port)
+    print(f"serving on {host}:{port}", file = sys.stderr)
+    async with server:
+        await server.serve_forever()
+
+
+async def serve_stdio(service):
+    """
+    serves the line protocol (see SolverService.handle) on stdin/stdout,
+    until stdin is closed
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    out = sys.stdout.buffer
+
+    async def write(data):
+        out.write(data)
+        out.flush()
+
+    await service.handle(reader, write)
+
+
+async def run(args):
+    """
+    starts a service with the command-line settings and serves it
+    """
+    service = SolverService(workers = args.workers, batch_size = args.batch_size, batch_delay = args.batch_delay/1000,
+                            max_pending = args.max_pending, engine = args.engine, timeout = args.timeout,
+                            max_steps = args.max_steps, box_size = args.box_size)
+    await service.start()
+    try:
+        if args.stdio:
+            await serve_stdio(service)
+        else:
+            await serve_tcp(service, args.host, args.port)
+    finally:
+        await service.stop()
+        print(json.dumps(service.stats()), file = sys.stderr)
+
+
+def main(argv = None):
+    """
+    command-line entry point:
+        python -m SudokuService [--stdio | --host H --port P] [--workers N]
+            [--batch-size N] [--batch-delay MS] [--max-pending N]
+            [--engine dlx] [--timeout SECONDS] [--max-steps MOVES] [--box-size N]
+    """
+    parser = argparse.ArgumentParser(prog = "python -m SudokuService")
+    parser.add_argument("--stdio", action = "store_true", help = "serve stdin/stdout instead of TCP")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 8765)
+    parser.add_argument("--workers", type = int, default = None, help = "worker processes (default: one per core)")
+    parser.add_argument("--batch-size", type = int, default = 32, help = "most puzzles sent to a worker at a time")
+    parser.add_argument("--batch-delay", type = float, default = 2.0, help = "milliseconds a batch may wait to fill up")
+    parser.add_argument("--max-pending", type = int, default = 1024, help = "queued requests before pushing back")
+    parser.add_argument("--engine", choices = ENGINES, default = "moves", help = "search engine")
+    parser.add_argument("--timeout", type = float, default = None, help = "seconds allowed per puzzle")
+    parser.add_argument("--max-steps", type = int, default = None, help = "moves allowed per puzzle")
+    parser.add_argument("--box-size", type = int, default = 3, help = "box size of the puzzles (3 for 9x9, 4 for 16x16...)")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,83 @@
+import os
+import random
+import tempfile
+import unittest
+
+from SudokuBenchmark import load_corpus
+from SudokuCache import SolutionCache
+from SudokuProblem import SudokuProblem, UnsolvableError
+
+
+def _transform(line, rng):
+    """
+    returns a random equivalent of a 9x9 puzzle line: digits relabelled,
+    bands, rows inside bands, stacks and columns inside stacks shuffled,
+    and the grid transposed half of the time
+    """
+    digits = list("123456789")
+    rng.shuffle(digits)
+    relabel = dict(zip("123456789", digits))
+    relabel["0"] = "0"
+    bands = rng.sample(range(3), 3)
+    rows = [3*band + i for band in bands for i in rng.sample(range(3), 3)]
+    stacks = rng.sample(range(3), 3)
+    cols = [3*stack + i for stack in stacks for i in rng.sample(range(3), 3)]
+    transpose = rng.random() < 0.5
+    out = []
+    for r in range(9):
+        for c in range(9):
+            row, col = rows[r], cols[c]
+            if transpose:
+                row, col = col, row
+            out.append(relabel[line[9*row + col]])
+    return "".join(out)
+
+
+class SolutionCacheTest(unittest.TestCase):
+    """
+    equivalent puzzles are answered from the cache, with the stored
+    solution mapped back onto them
+    """
+
+    def test_equivalent_puzzles_hit(self):
+        rng = random.Random(12)
+        cache = SolutionCache()
+        puzzles = load_corpus("hard")[:10] + load_corpus("17clue")[:10] + load_corpus("easy")[:5]
+        for puzzle in puzzles:
+            cache.solve(puzzle)
+            for _ in range(8):
+                variant = _transform(puzzle, rng)
+                misses = cache.misses
+                hits = cache.hits
+                self.assertEqual(cache.solve(variant), SudokuProblem(variant).solve(), (puzzle, variant))
+                self.assertEqual((cache.hits, cache.misses), (hits + 1, misses), variant)
+
+    def test_unsolvable_variants_hit(self):
+        rng = random.Random(13)
+        cache = SolutionCache()
+        puzzle = load_corpus("pathological")[0]
+        with self.assertRaises(UnsolvableError):
+            cache.solve(puzzle)
+        for _ in range(4):
+            with self.assertRaises(UnsolvableError):
+                cache.solve(_transform(puzzle, rng))
+        self.assertEqual((cache.hits, cache.misses), (4, 1))
+
+    def test_save_and_load(self):
+        with self.assertRaises(ValueError):
+            SolutionCache().save()
+        puzzle = load_corpus("hard")[0]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cache.json")
+            cache = SolutionCache(path = path)
+            expected = cache.solve(puzzle)
+            cache.save()
+            loaded = SolutionCache(path = path)
+            variant = _transform(puzzle, random.Random(14))
+            self.assertEqual(loaded.solve(variant), SudokuProblem(variant).solve())
+            self.assertEqual(loaded.solve(puzzle), expected)
+            self.assertEqual(loaded.misses, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,185 @@
+import itertools
+import os
+import tempfile
+import unittest
+
+from SudokuBenchmark import TIERS, load_corpus
+from SudokuProblem import (BudgetExceededError, MultipleSolutionsError, SudokuProblem, UnsolvableError, format_line,
+                           search_parallel, solve_file, split_search)
+
+
+def _solve_outcome(problem):
+    """
+    returns solve()'s solution, or the class of the error it raised
+    """
+    try:
+        return problem.solve()
+    except (UnsolvableError, MultipleSolutionsError) as error:
+        return type(error)
+
+
+class RepeatedQueriesTest(unittest.TestCase):
+    """
+    the search entry points give the same answers whatever ran before
+    them on the same solver
+    """
+
+    # a unique puzzle, a puzzle with several solutions (the first one with
+    # clues removed) and an unsolvable one (the first one with a clue
+    # changed, which takes a few bifurcations to refute)
+    PUZZLES = [
+        load_corpus("hard")[0],
+        "0"*40 + load_corpus("hard")[0][40:],
+        load_corpus("hard")[0][:66] + "3" + load_corpus("hard")[0][67:],
+    ]
+
+    def queries(self, problem):
+        return {
+            "is_unique": lambda: problem.is_unique(),
+            "solve": lambda: _solve_outcome(problem),
+            "count": lambda: problem.count_solutions(2, 1),
+            "iter": lambda: (list(problem.iter_search()), problem.found_count)[1],
+        }
+
+    def test_any_order(self):
+        for puzzle in self.PUZZLES:
+            fresh = {}
+            for name in self.queries(None):
+                fresh[name] = self.queries(SudokuProblem(puzzle))[name]()
+            for order in itertools.permutations(fresh):
+                problem = SudokuProblem(puzzle)
+                queries = self.queries(problem)
+                for name in order + order:
+                    self.assertEqual(queries[name](), fresh[name], (puzzle, order, name))
+                # the other engine counts the same after them (its first
+                # solution can differ when there are several)
+                self.assertEqual(problem.count_solutions(2, 0, engine = "dlx")[0], fresh["count"][0], (puzzle, order))
+
+    def test_after_budget_error(self):
+        puzzle = self.PUZZLES[0]
+        expected = SudokuProblem(puzzle).solve()
+        problem = SudokuProblem(puzzle)
+        with self.assertRaises(BudgetExceededError):
+            problem.solve(max_steps = 10)
+        self.assertEqual(problem.solve(), expected)
+
+
+class EnginesTest(unittest.TestCase):
+    """
+    the move stack and the exact cover engine agree on every bundled
+    puzzle
+    """
+
+    def test_bundled_tiers(self):
+        # the tiers only hold unique and unsolvable puzzles: hard
+        # puzzles with their first clues blanked out add multiple ones
+        tiers = {tier: load_corpus(tier) for tier in TIERS}
+        tiers["blanked"] = ["0"*30 + puzzle[30:] for puzzle in tiers["hard"]]
+        moves = SudokuProblem()
+        dlx = SudokuProblem()
+        counts = set()
+        for tier, puzzles in tiers.items():
+            for puzzle in puzzles:
+                count, solutions = moves.reset(puzzle).count_solutions(2, 1)
+                dlx_count, dlx_solutions = dlx.reset(puzzle).count_solutions(2, 1, engine = "dlx")
+                self.assertEqual(dlx_count, count, (tier, puzzle))
+                if count == 1:
+                    self.assertEqual(dlx_solutions, solutions, (tier, puzzle))
+                counts.add(count)
+        self.assertEqual(counts, {0, 1, 2})
+
+
+class ResetTest(unittest.TestCase):
+    """
+    reset() rejects invalid puzzles without touching the solver
+    """
+
+    def test_rejected_puzzle(self):
+        puzzle = load_corpus("hard")[0]
+        problem = SudokuProblem(puzzle)
+        for invalid in ("11" + "0"*79, "1"*80, [[0]*9]*8):
+            with self.assertRaises((TypeError, ValueError)):
+                problem.reset(invalid)
+            self.assertEqual(problem.solve(), SudokuProblem(puzzle).solve())
+
+
+class SolveFileTest(unittest.TestCase):
+    """
+    solve_file() answers every input line on the same output line
+    """
+
+    def test_lines_stay_aligned(self):
+        puzzles = load_corpus("hard")[:3]
+        solution = format_line([value for row in SudokuProblem(puzzles[0]).solve() for value in row])
+        lines = ["# comment", puzzles[0], "", puzzles[1], "11" + "0"*79, "", "# another", puzzles[2]]
+        with tempfile.TemporaryDirectory() as directory:
+            in_path = os.path.join(directory, "in.txt")
+            out_path = os.path.join(directory, "out.txt")
+            with open(in_path, "w") as file:
+                file.write("\n".join(lines) + "\n")
+            for workers in (1, 2):
+                totals = solve_file(in_path, out_path, workers = workers, chunksize = 3)
+                with open(out_path) as file:
+                    output = file.read().split("\n")
+                self.assertEqual(len(output), len(lines) + 1)
+                self.assertEqual(output[1], solution)
+                self.assertEqual([output[i] for i in (0, 2, 4, 5, 6)], ["# comment", "", "invalid", "", "# another"])
+                self.assertEqual(totals, {"solved": 3, "invalid": 1})
+
+
+class SplitSearchTest(unittest.TestCase):
+    """
+    splitting a search tree stops at the caller's solution limit
+    """
+
+    def test_limit(self):
+        solution = format_line([value for row in SudokuProblem(load_corpus("hard")[0]).solve() for value in row])
+        # blanks out every deadly rectangle (a b / b a over two boxes of
+        # a band), each of which can be filled both ways
+        blanks = set()
+        for r1 in range(9):
+            for r2 in range(r1 + 1, 3*(r1//3) + 3):
+                for c1, c2 in itertools.combinations(range(9), 2):
+                    if solution[9*r1 + c1] == solution[9*r2 + c2] and solution[9*r1 + c2] == solution[9*r2 + c1]:
+                        blanks.update((9*r1 + c1, 9*r1 + c2, 9*r2 + c1, 9*r2 + c2))
+        puzzle = "".join("0" if cell in blanks else value for cell, value in enumerate(solution))
+        total = SudokuProblem(puzzle).count_solutions(None)[0]
+        self.assertGreater(total, 2)
+        for limit in (1, 2):
+            self.assertEqual(len(split_search(puzzle, 10**6, limit = limit)[2]), limit)
+            self.assertEqual(search_parallel(puzzle, limit, workers = 1)[0], limit)
+        self.assertEqual(len(split_search(puzzle, 10**6, limit = None)[2]), total)
+
+
+class LearningTest(unittest.TestCase):
+    """
+    conflict learning prunes the search without changing its outcome
+    """
+
+    def test_same_counts(self):
+        plain = SudokuProblem(rules = ())
+        learning = SudokuProblem(rules = (), learning = True, max_nogoods = 8)
+        rewinds = [0, 0]
+        for puzzle in load_corpus("hard"):
+            expected = plain.reset(puzzle).count_solutions(2, 1)
+            self.assertEqual(learning.reset(puzzle).count_solutions(2, 1), expected, puzzle)
+            self.assertLessEqual(len(learning.nogoods), 8)
+            rewinds[0] += plain.stats.rewinds
+            rewinds[1] += learning.stats.rewinds
+        self.assertLess(rewinds[1], rewinds[0])
+
+    def test_restore_needs_same_mode(self):
+        puzzle = load_corpus("hard")[0]
+        problem = SudokuProblem(puzzle, learning = True)
+        next(problem.iter_search())
+        state = problem.snapshot()
+        with self.assertRaises(ValueError):
+            SudokuProblem().restore(state)
+        restored = SudokuProblem(learning = True).restore(state)
+        for _ in restored.resume():
+            pass
+        self.assertEqual(restored.solution(), SudokuProblem(puzzle).solve())
+
+
+if __name__ == '__main__':
+    unittest.main()